@@ -5,9 +5,67 @@ Check what columns actually exist in the ARVO database
 
 import sys
 import os
+import json
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from validator.ssh_client import run_remote_command, ARVO_DB_PATH
+from validator.arvo_data_loader import get_db_mtime
+
+SPLIT_MARKER = "---SPLIT---"
+SCHEMA_CACHE_FILE = os.path.expanduser("~/.cache/smart-patch-agent/arvo_schema.json")
+
+
+def load_cached_schema(mtime: str):
+    """Returns the cached probe outputs if they were taken at this DB mtime."""
+    try:
+        with open(SCHEMA_CACHE_FILE, 'r') as f:
+            cached = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    
+    if cached.get('mtime') != mtime:
+        return None
+    return cached.get('sections')
+
+
+def save_cached_schema(mtime: str, sections) -> None:
+    """Stores the probe outputs keyed by the remote DB mtime."""
+    try:
+        os.makedirs(os.path.dirname(SCHEMA_CACHE_FILE), exist_ok=True)
+        with open(SCHEMA_CACHE_FILE, 'w') as f:
+            json.dump({'mtime': mtime, 'sections': sections}, f)
+    except OSError as e:
+        print(f"Warning: Could not write schema cache: {e}")
+
+
+def probe_database_schema():
+    """Runs the schema, column and sample probes remotely and returns their outputs."""
+    
+    # All three probes run in a single sqlite3 session (one SSH round-trip);
+    # a sentinel line separates their outputs.
+    probe_cmd = f"""sqlite3 {ARVO_DB_PATH} <<'SQL'
+.schema arvo
+.print {SPLIT_MARKER}
+PRAGMA table_info(arvo);
+.print {SPLIT_MARKER}
+.mode list
+SELECT name, type FROM pragma_table_info('arvo')
+WHERE EXISTS (SELECT 1 FROM arvo WHERE localId=40096184);
+SQL"""
+
+    print("\nRunning schema, column and sample probes...")
+    exit_code, stdout, stderr = run_remote_command(probe_cmd)
+    
+    if exit_code != 0:
+        print(f"❌ Failed to query database: {stderr}")
+        return None
+    
+    sections = [part.strip() for part in stdout.split(SPLIT_MARKER)]
+    if len(sections) != 3:
+        print(f"❌ Unexpected probe output:\n{stdout}")
+        return None
+    return sections
+
 
 def check_database_schema():
     """Query the database schema to see available columns"""
@@ -16,56 +74,42 @@ def check_database_schema():
     print("CHECKING ARVO DATABASE SCHEMA")
     print("="*80)
     
-    # Get table schema
-    schema_cmd = f"sqlite3 {ARVO_DB_PATH} '.schema arvo'"
-    
-    print("\n1. Getting table schema...")
-    exit_code, stdout, stderr = run_remote_command(schema_cmd)
+    # The schema rarely changes: one cheap stat decides whether the cached
+    # probe output is still valid
+    mtime = get_db_mtime()
     
-    if exit_code == 0:
-        print("✅ Schema retrieved successfully:\n")
-        print(stdout)
+    sections = load_cached_schema(mtime) if mtime else None
+    if sections is not None:
+        print(f"\nUsing cached schema (DB mtime {mtime})")
     else:
-        print(f"❌ Failed to get schema: {stderr}")
-        return
+        sections = probe_database_schema()
+        if sections is None:
+            return
+        if mtime:
+            save_cached_schema(mtime, sections)
+    schema_out, columns_out, sample_out = sections
     
-    # Get column names using PRAGMA
-    pragma_cmd = f"sqlite3 {ARVO_DB_PATH} 'PRAGMA table_info(arvo);'"
+    # Get table schema
+    print("\n1. Getting table schema...")
+    print("✅ Schema retrieved successfully:\n")
+    print(schema_out)
     
+    # Get column names using PRAGMA
     print("\n2. Getting column information...")
-    exit_code, stdout, stderr = run_remote_command(pragma_cmd)
+    print("✅ Columns available:\n")
+    print(columns_out)
     
-    if exit_code == 0:
-        print("✅ Columns available:\n")
-        print(stdout)
+    # Check the sample row exists; only column names/types cross the wire,
+    # never the (multi-KB) crash logs and reproducer strings themselves
+    print("\n3. Getting sample fields for bug 40096184...")
+    if not sample_out:
+        print("❌ Sample bug 40096184 not found")
     else:
-        print(f"❌ Failed to get columns: {stderr}")
-        return
-    
-    # Get a sample row to see what data looks like
-    sample_cmd = f"sqlite3 -json {ARVO_DB_PATH} 'SELECT * FROM arvo WHERE localId=40096184 LIMIT 1;'"
-    
-    print("\n3. Getting sample data for bug 40096184...")
-    exit_code, stdout, stderr = run_remote_command(sample_cmd)
-    
-    if exit_code == 0:
         print("✅ Sample data retrieved:\n")
-        import json
-        try:
-            data = json.loads(stdout)
-            if data:
-                # Pretty print the first entry
-                print("Available fields:")
-                for key in data[0].keys():
-                    value = data[0][key]
-                    if isinstance(value, str) and len(value) > 100:
-                        print(f"  - {key}: (string, {len(value)} chars)")
-                    else:
-                        print(f"  - {key}: {type(value).__name__}")
-        except json.JSONDecodeError:
-            print(stdout)
-    else:
-        print(f"❌ Failed to get sample data: {stderr}")
+        print("Available fields:")
+        for row in sample_out.splitlines():
+            key, _, col_type = row.partition('|')
+            print(f"  - {key}: {col_type or 'untyped'}")
     
     print("\n" + "="*80)
     print("RECOMMENDATION:")
@@ -0,0 +1,46 @@
+# config.py
+"""
+Environment-derived settings, resolved once per process at import time.
+Importing this module has no other side effects: the entry points print
+ENV_SOURCE and call setup_logging() themselves.
+"""
+
+import logging
+import os
+from pathlib import Path
+
+# Only parse the .env file when the key isn't already in the environment;
+# ENV_SOURCE says where the settings came from
+if os.environ.get('MISTRAL_API_KEY'):
+    ENV_SOURCE = "MISTRAL_API_KEY found in environment, skipping .env file"
+else:
+    # Load environment variables from .env file if it exists
+    try:
+        from dotenv import load_dotenv
+        env_path = Path('.') / '.env'
+        if env_path.exists():
+            load_dotenv(dotenv_path=env_path)
+            ENV_SOURCE = "Loaded environment variables from .env file"
+        else:
+            ENV_SOURCE = "No .env file found, using system environment variables"
+    except ImportError:
+        ENV_SOURCE = "python-dotenv not installed, using system environment variables"
+
+MISTRAL_API_KEY = os.environ.get('MISTRAL_API_KEY')
+
+# Codestral requests allowed in flight at once across all concurrently
+# processed bugs (raise it for higher API rate-limit tiers)
+MAX_CONCURRENT_LLM_CALLS = int(os.environ.get('SPA_MAX_CONCURRENT_LLM', 4))
+
+# Optional; raises the GitHub API rate limit used when fetching code of
+# GitHub-hosted projects (60 requests/hour without it)
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
+
+# Per-call diagnostics (prompt sizes, patch previews, fetch details) are logged
+# at DEBUG; SPA_LOG_LEVEL=DEBUG shows them, the default keeps them silent
+LOG_LEVEL = getattr(logging, os.environ.get('SPA_LOG_LEVEL', 'WARNING').upper(), logging.WARNING)
+
+
+def setup_logging() -> None:
+    """Configures the root logger at LOG_LEVEL; called by the entry points only."""
+    logging.basicConfig(level=LOG_LEVEL, format='%(message)s')
@@ -5,10 +5,14 @@ Quick test to verify the workaround is working
 
 import sys
 import os
+import re
 
 # Add project to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# Security terms that tend to trip LLM safety filters, matched in one pass
+RISKY_TERMS_RE = re.compile(r"overflow|exploit|vulnerability|crash|asan", re.IGNORECASE)
+
 def test_imports():
     """Test that all imports work"""
     print("="*80)
@@ -16,10 +20,10 @@ def test_imports():
     print("="*80)
     
     try:
-        from workflow.graph_builder import build_patch_agent_graph
-        print("✅ graph_builder imported")
+        from workflow.bootstrap import get_app
+        print("✅ bootstrap imported")
     except Exception as e:
-        print(f"❌ graph_builder failed: {e}")
+        print(f"❌ bootstrap failed: {e}")
         return False
     
     try:
@@ -129,8 +133,7 @@ def test_patch_generation():
         print(f"✅ Generated safe prompt ({len(prompt)} chars)")
         
         # Check that it doesn't contain risky terms
-        risky_terms = ['overflow', 'exploit', 'vulnerability', 'crash', 'asan']
-        found_risky = [term for term in risky_terms if term.lower() in prompt.lower()]
+        found_risky = sorted({term.lower() for term in RISKY_TERMS_RE.findall(prompt)})
         
         if found_risky:
             print(f"⚠️  Warning: Prompt contains potentially risky terms: {found_risky}")
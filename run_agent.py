@@ -1,22 +1,12 @@
 # run_agent.py
 
 import os
-from pathlib import Path
 
-# Load environment variables from .env file if it exists
-try:
-    from dotenv import load_dotenv
-    env_path = Path('.') / '.env'
-    if env_path.exists():
-        load_dotenv(dotenv_path=env_path)
-        print("Loaded environment variables from .env file")
-    else:
-        print("No .env file found, using system environment variables")
-except ImportError:
-    print("python-dotenv not installed, using system environment variables")
+# Resolves MISTRAL_API_KEY once (reading .env only if it isn't already set)
+from config import MISTRAL_API_KEY, ENV_SOURCE, setup_logging
 
 # Verify API key is set
-api_key = os.environ.get('MISTRAL_API_KEY')
+api_key = MISTRAL_API_KEY
 if api_key:
     print(f"MISTRAL_API_KEY is set (length: {len(api_key)} chars)")
 else:
@@ -28,7 +18,7 @@ else:
 from langgraph.graph import START, END, StateGraph 
 
 # Import from your custom package 
-from workflow.graph_builder import build_patch_agent_graph
+from workflow.bootstrap import get_app
 from workflow.state import AgentState, PatchAttempt
 
 # Define Mock Input Data
@@ -41,9 +31,15 @@ initial_state_input: AgentState = {
     "bug_data": {},
     "all_patches": [],
     "current_patch": "",
+    "candidate_patches": [],
     "validation_result": {},
     "failure_reason": "",
     "lsp_context": "",
+    "is_success": False,
+    "repo_checked_out_at": "",
+    "actual_code": "",
+    "context_lines": 0,
+    "analysis": {},
     "retry_count": 0,
 }
 
@@ -54,22 +50,36 @@ def run_test_workflow():
     print("--- Starting LangGraph Patch Agent Test ---")
     
     # Build the compiled LangGraph application
-    app = build_patch_agent_graph()
+    app = get_app()
     
-    # Generate Visualization (Mermaid Format)
-    try:
-        graph_object = app.get_graph()
-        mermaid_text = graph_object.draw_mermaid()
-        
-        mermaid_filename = "patch_agent_workflow.mermaid"
-        with open(mermaid_filename, "w") as f:
-            f.write(mermaid_text)
+    # Generate Visualization (Mermaid Format), only when the graph definition
+    # is newer than the existing diagram
+    mermaid_filename = "patch_agent_workflow.mermaid"
+    graph_source = os.path.join("workflow", "graph_builder.py")
+    
+    if (os.path.exists(mermaid_filename) and os.path.exists(graph_source) and
+            os.path.getmtime(mermaid_filename) >= os.path.getmtime(graph_source)):
+        print(f"\n Graph visualization is up to date: {mermaid_filename}")
+    else:
+        try:
+            graph_object = app.get_graph()
+            mermaid_text = graph_object.draw_mermaid()
             
-        print("\n Successfully generated graph visualization in Mermaid format:")
-        print(f"   Saved to: {mermaid_filename}")
-        
-    except Exception as e:
-        print(f"\n Could not generate graph image in Mermaid format. Error: {e}")
+            existing_text = None
+            if os.path.exists(mermaid_filename):
+                with open(mermaid_filename, "r") as f:
+                    existing_text = f.read()
+            
+            # Skip the write when the regenerated diagram is identical
+            if mermaid_text != existing_text:
+                with open(mermaid_filename, "w") as f:
+                    f.write(mermaid_text)
+                
+            print("\n Successfully generated graph visualization in Mermaid format:")
+            print(f"   Saved to: {mermaid_filename}")
+            
+        except Exception as e:
+            print(f"\n Could not generate graph image in Mermaid format. Error: {e}")
 
     inputs = initial_state_input.copy()
 
@@ -97,4 +107,6 @@ def run_test_workflow():
         traceback.print_exc()
 
 if __name__ == "__main__":
+    print(ENV_SOURCE)
+    setup_logging()
     run_test_workflow()
\ No newline at end of file
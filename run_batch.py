@@ -1,14 +1,30 @@
 #!/usr/bin/env python3
 import os
 import json
+import shlex
 import time
-from typing import List
-from validator.ssh_client import run_remote_command, ARVO_DB_PATH
-from workflow.graph_builder import build_patch_agent_graph
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any
+from validator.ssh_client import run_remote_command, ARVO_DB_PATH, ARVO_DB_PRAGMAS
+from validator.arvo_data_loader import load_bug_data_batch
+from validator.image_cache import prefetch_images
+from workflow.bootstrap import get_app
+from workflow.batch_generation import batch_lightweight_generate
+from config import ENV_SOURCE, setup_logging
+
+# orjson is a faster drop-in for the JSON (de)serialization below, if installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configuration
 LIMIT = 10
-OUTPUT_FILE = "batch_results.json"
+OUTPUT_FILE = "batch_results.jsonl"
+MAX_WORKERS = 4  # Bugs processed concurrently (bounded by SSH_POOL_SIZE / LLM rate limits)
+# BATCH_MODE=1 generates every initial patch in one (cheaper, slower) Batch API
+# job before the graphs start; refinement retries still call the API directly
+BATCH_MODE = os.environ.get('BATCH_MODE') == '1'
 
 def get_testable_bug_ids(limit: int) -> List[int]:
     """Fetch bug IDs from ARVO that have a reproducer script."""
@@ -18,13 +34,12 @@ def get_testable_bug_ids(limit: int) -> List[int]:
     # We sort by localId to get a consistent set
     query = f"""
     SELECT localId FROM arvo 
-    WHERE reproducer_vul IS NOT NULL 
-    AND reproducer_vul != ''
+    WHERE length(reproducer_vul) > 0
     ORDER BY localId DESC
-    LIMIT {limit};
+    LIMIT {int(limit)};
     """
     
-    cmd = f"sqlite3 -json {ARVO_DB_PATH} \"{query}\""
+    cmd = f"exec sqlite3 -json -bail {shlex.quote(ARVO_DB_PATH)} {ARVO_DB_PRAGMAS} {shlex.quote(query)}"
     exit_code, stdout, stderr = run_remote_command(cmd)
     
     if exit_code != 0:
@@ -32,12 +47,70 @@ def get_testable_bug_ids(limit: int) -> List[int]:
         return []
         
     try:
-        data = json.loads(stdout)
+        data = orjson.loads(stdout) if orjson else json.loads(stdout)
         return [item['localId'] for item in data]
     except json.JSONDecodeError:
         print("[BATCH] Failed to parse DB response")
         return []
 
+def process_one(app, bug_id: int, index: int, total: int, bug_data: Dict[str, Any],
+                initial_patch: str = "") -> Dict[str, Any]:
+    """Runs the patch agent workflow for a single bug and returns its result entry."""
+    print(f"\n{'='*60}")
+    print(f"PROCESSING BUG {index}/{total}: ID {bug_id}")
+    print(f"{'='*60}")
+    
+    start_time = time.perf_counter_ns()
+    
+    initial_state = {
+        "bug_id": str(bug_id),
+        "initial_crash_log": "",
+        "buggy_code_snippet": "",
+        "max_retries": 3,
+        "bug_data": bug_data,
+        "all_patches": [],
+        "current_patch": initial_patch,
+        "candidate_patches": [],
+        "validation_result": {},
+        "failure_reason": "",
+        "lsp_context": "",
+        "is_success": False,
+        "repo_checked_out_at": "",
+        "actual_code": "",
+        "context_lines": 0,
+        "analysis": {},
+        "retry_count": 0,
+    }
+    
+    try:
+        # Execute Workflow
+        final_state = app.invoke(initial_state)
+        
+        # Analyze Result
+        val_result = final_state.get('validation_result', {})
+        success = (not val_result.get('poc_crash_detected', True) and 
+                   val_result.get('functional_tests_passed', False))
+        
+        status = "SUCCESS" if success else "FAILED"
+        print(f"\n[BATCH] Bug {bug_id} Finished: {status}")
+        
+        return {
+            "bug_id": bug_id,
+            "status": status,
+            "attempts": final_state.get('retry_count', 0),
+            "duration_ms": (time.perf_counter_ns() - start_time) // 1_000_000,
+            "failure_reason": final_state.get('failure_reason', ''),
+            "final_patch": final_state.get('current_patch', '')
+        }
+        
+    except Exception as e:
+        print(f"[BATCH] Critical Error on Bug {bug_id}: {e}")
+        return {
+            "bug_id": bug_id,
+            "status": "ERROR",
+            "error": str(e)
+        }
+
 def run_batch():
     bug_ids = get_testable_bug_ids(LIMIT)
     
@@ -47,74 +120,54 @@ def run_batch():
 
     print(f"[BATCH] Found {len(bug_ids)} bugs: {bug_ids}")
     
+    # One query for every bug's data; the input processor skips its own lookup
+    # for prefetched bugs (and falls back to it for any that are missing)
+    prefetched = load_bug_data_batch(bug_ids)
+    
+    # Image pulls run on the VM while the first patches are being generated
+    prefetch_images(bug.get('reproducer_vul', '') for bug in prefetched.values())
+    
+    pregenerated = batch_lightweight_generate(prefetched) if BATCH_MODE else {}
+    
     # Initialize the graph once
-    app = build_patch_agent_graph()
+    app = get_app()
     
-    results = []
+    total_count = 0
+    success_count = 0
     
-    for i, bug_id in enumerate(bug_ids):
-        print(f"\n{'='*60}")
-        print(f"PROCESSING BUG {i+1}/{len(bug_ids)}: ID {bug_id}")
-        print(f"{'='*60}")
-        
-        start_time = time.time()
-        
-        initial_state = {
-            "bug_id": str(bug_id),
-            "initial_crash_log": "",
-            "buggy_code_snippet": "",
-            "max_retries": 3,
-            "bug_data": {},
-            "all_patches": [],
-            "current_patch": "",
-            "validation_result": {},
-            "failure_reason": "",
-            "lsp_context": "",
-            "retry_count": 0,
-        }
-        
-        try:
-            # Execute Workflow
-            final_state = app.invoke(initial_state)
-            
-            # Analyze Result
-            val_result = final_state.get('validation_result', {})
-            success = (not val_result.get('poc_crash_detected', True) and 
-                       val_result.get('functional_tests_passed', False))
-            
-            status = "SUCCESS" if success else "FAILED"
-            print(f"\n[BATCH] Bug {bug_id} Finished: {status}")
-            
-            results.append({
-                "bug_id": bug_id,
-                "status": status,
-                "attempts": final_state.get('retry_count', 0),
-                "duration": round(time.time() - start_time, 2),
-                "failure_reason": final_state.get('failure_reason', ''),
-                "final_patch": final_state.get('current_patch', '')
-            })
-            
-        except Exception as e:
-            print(f"[BATCH] Critical Error on Bug {bug_id}: {e}")
-            results.append({
-                "bug_id": bug_id,
-                "status": "ERROR",
-                "error": str(e)
-            })
-
-    # Save Results
-    with open(OUTPUT_FILE, 'w') as f:
-        json.dump(results, f, indent=2)
+    # Each result is appended to the JSONL file as soon as its bug finishes, so
+    # partial progress survives a crash and nothing accumulates in memory
+    with open(OUTPUT_FILE, 'w', buffering=1) as f:
+        # Bugs are independent and I/O-bound (SSH + LLM), so run them concurrently
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(process_one, app, bug_id, i + 1, len(bug_ids), prefetched.get(bug_id, {}),
+                                pregenerated.get(bug_id, "")): bug_id
+                for i, bug_id in enumerate(bug_ids)
+            }
+            # as_completed yields in this (main) thread, so no lock is needed
+            for future in as_completed(futures):
+                result = future.result()
+                if orjson:
+                    f.write(orjson.dumps(result).decode() + "\n")
+                else:
+                    f.write(json.dumps(result) + "\n")
+                f.flush()
+                
+                total_count += 1
+                if result['status'] == 'SUCCESS':
+                    success_count += 1
         
     # Print Summary
     print(f"\n{'='*60}")
     print("BATCH EXECUTION SUMMARY")
     print(f"{'='*60}")
-    success_count = sum(1 for r in results if r['status'] == 'SUCCESS')
-    print(f"Total Bugs: {len(results)}")
+    print(f"Total Bugs: {total_count}")
     print(f"Success:    {success_count}")
-    print(f"Failed:     {len(results) - success_count}")
+    print(f"Failed:     {total_count - success_count}")
     print(f"Results saved to: {OUTPUT_FILE}")
 
 if __name__ == "__main__":
+    print(ENV_SOURCE)
+    setup_logging()
     run_batch()
\ No newline at end of file
@@ -5,6 +5,12 @@ Test script to debug Codestral API connection
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# --all: probe every model concurrently and print a table instead of stopping
+# at the first one that works
+PROBE_ALL = "--all" in sys.argv
+PROBE_TIMEOUT_MS = 10000  # Fail fast on unreachable models
 
 print("=" * 80)
 print("CODESTRAL API DIAGNOSIS")
@@ -52,8 +58,8 @@ models_to_test = [
     'codestral-mamba-latest'
 ]
 
-for model in models_to_test:
-    print(f"\n4. Testing with model: {model}")
+def probe_model(model):
+    """Sends one tiny request with the shared client; returns (content, error)."""
     try:
         response = client.chat.complete(
             model=model,
@@ -64,33 +70,57 @@ for model in models_to_test:
                 }
             ],
             temperature=0.1,
-            max_tokens=50
+            max_tokens=50,
+            timeout_ms=PROBE_TIMEOUT_MS
         )
         
         if response and response.choices:
-            content = response.choices[0].message.content
+            return response.choices[0].message.content, None
+        return None, "Empty response"
+        
+    except Exception as e:
+        return None, str(e)
+
+def diagnose_error(model, error_msg):
+    """Prints a hint for the common API failure modes."""
+    if "401" in error_msg or "Unauthorized" in error_msg:
+        print("\n   Diagnosis: API key is not valid or not authorized for this model")
+        print("   Solutions:")
+        print("   1. Verify your API key at https://console.mistral.ai/")
+        print("   2. Check if your account has access to Codestral")
+        print("   3. Make sure you're using a Codestral-specific API key")
+    elif "404" in error_msg:
+        print(f"   Diagnosis: Model '{model}' not found")
+    elif "429" in error_msg:
+        print("   Diagnosis: Rate limit exceeded")
+
+if PROBE_ALL:
+    print(f"\n4. Testing all models concurrently: {', '.join(models_to_test)}")
+    # The client (and its underlying HTTP session) is shared by all probes
+    with ThreadPoolExecutor(max_workers=len(models_to_test)) as executor:
+        probe_results = list(executor.map(probe_model, models_to_test))
+    
+    print(f"\n   {'MODEL':<25} {'RESULT':<8} DETAILS")
+    for model, (content, error) in zip(models_to_test, probe_results):
+        if error is None:
+            print(f"   {model:<25} {'OK':<8} {content[:60]!r}")
+        else:
+            print(f"   {model:<25} {'FAILED':<8} {error[:60]}")
+else:
+    for model in models_to_test:
+        print(f"\n4. Testing with model: {model}")
+        content, error = probe_model(model)
+        
+        if error is None:
             print(f"   SUCCESS with {model}!")
             print(f"   Response: {content[:100]}")
             print(f"\n✓ Use this model: {model}")
             break
-        else:
+        elif error == "Empty response":
             print(f"   FAILED: Empty response from {model}")
-            
-    except Exception as e:
-        error_msg = str(e)
-        print(f"   FAILED with {model}: {error_msg[:200]}")
-        
-        # Check for specific errors
-        if "401" in error_msg or "Unauthorized" in error_msg:
-            print("\n   Diagnosis: API key is not valid or not authorized for this model")
-            print("   Solutions:")
-            print("   1. Verify your API key at https://console.mistral.ai/")
-            print("   2. Check if your account has access to Codestral")
-            print("   3. Make sure you're using a Codestral-specific API key")
-        elif "404" in error_msg:
-            print(f"   Diagnosis: Model '{model}' not found")
-        elif "429" in error_msg:
-            print("   Diagnosis: Rate limit exceeded")
+        else:
+            print(f"   FAILED with {model}: {error[:200]}")
+            diagnose_error(model, error)
 
 print("\n" + "=" * 80)
 print("DIAGNOSIS COMPLETE")
@@ -5,6 +5,12 @@ Test Gemini's safety filters to understand what triggers blocking.
 
 from google import genai
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_CONCURRENT_REQUESTS = 5  # Keep under Gemini's per-minute rate limit
+print_lock = threading.Lock()
 
 # Initialize client
 try:
@@ -141,32 +147,49 @@ Output only the patch."""
 
 def test_prompt(name: str, prompt: str) -> dict:
     """Test a single prompt and return results"""
-    print(f"\n{'='*80}")
-    print(f"Testing: {name}")
-    print(f"{'='*80}")
-    print(f"Prompt length: {len(prompt)} chars")
+    # Output is buffered and printed in one go so parallel tests don't interleave
+    log = [
+        f"\n{'='*80}",
+        f"Testing: {name}",
+        f"{'='*80}",
+        f"Prompt length: {len(prompt)} chars",
+    ]
     
     try:
-        response = client.models.generate_content(
-            model=MODEL,
-            contents=prompt,
-            config={
-                'temperature': 0.1,
-                'max_output_tokens': 500
-            }
-        )
+        for attempt in range(2):
+            try:
+                response = client.models.generate_content(
+                    model=MODEL,
+                    contents=prompt,
+                    config={
+                        'temperature': 0.1,
+                        'max_output_tokens': 500
+                    }
+                )
+                break
+            except Exception as e:
+                # Back off once on rate limiting, then give up
+                if attempt == 0 and "429" in str(e):
+                    log.append("⚠️  Rate limited, retrying in 1s...")
+                    time.sleep(1)
+                    continue
+                raise
         
         if response.text is None:
-            print("❌ BLOCKED - Response is None")
-            return {"name": name, "blocked": True, "reason": "response.text is None"}
+            log.append("❌ BLOCKED - Response is None")
+            result = {"name": name, "blocked": True, "reason": "response.text is None"}
         else:
-            print(f"✅ SUCCESS - Generated {len(response.text)} chars")
-            print(f"Preview: {response.text[:100]}...")
-            return {"name": name, "blocked": False, "response_length": len(response.text)}
+            log.append(f"✅ SUCCESS - Generated {len(response.text)} chars")
+            log.append(f"Preview: {response.text[:100]}...")
+            result = {"name": name, "blocked": False, "response_length": len(response.text)}
             
     except Exception as e:
-        print(f"❌ ERROR - {type(e).__name__}: {str(e)[:100]}")
-        return {"name": name, "blocked": True, "reason": str(e)}
+        log.append(f"❌ ERROR - {type(e).__name__}: {str(e)[:100]}")
+        result = {"name": name, "blocked": True, "reason": str(e)}
+    
+    with print_lock:
+        print("\n".join(log))
+    return result
 
 def run_all_tests():
     """Run all test cases"""
@@ -175,10 +198,9 @@ def run_all_tests():
     print("="*80)
     print(f"Testing {len(test_cases)} prompts to identify what triggers blocking...\n")
     
-    results = []
-    for test in test_cases:
-        result = test_prompt(test["name"], test["prompt"])
-        results.append(result)
+    # Each test is a blocking API call; run them concurrently (map keeps order)
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        results = list(executor.map(lambda test: test_prompt(test["name"], test["prompt"]), test_cases))
     
     # Summary
     print("\n" + "="*80)
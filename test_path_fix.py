@@ -3,6 +3,13 @@
 Test that file path cleaning works correctly
 """
 
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from validator.path_utils import clean_crash_path
+
 def test_path_cleaning():
     """Test the path cleaning logic"""
     
@@ -34,18 +41,8 @@ def test_path_cleaning():
         file_path = test['input']
         expected = test['expected']
         
-        # Apply the cleaning logic
-        if '/../' in file_path:
-            parts = file_path.split('/../')
-            file_path = parts[-1]
-        
-        if file_path.startswith('/src/'):
-            file_path = file_path[5:]
-        
-        file_path = file_path.lstrip('/')
-        
-        while file_path.startswith('../'):
-            file_path = file_path[3:]
+        # Apply the shared cleaning logic (same function the workflow uses)
+        file_path = clean_crash_path(file_path)
         
         # Check result
         if file_path == expected:
@@ -65,7 +62,7 @@ if __name__ == "__main__":
     if test_path_cleaning():
         print("="*80)
         print("✅ All path cleaning tests passed!")
-        print("\nNow update workflow/nodes.py and try again:")
+        print("\nThe workflow uses the same validator/path_utils.py helper:")
         print("  python3 run_agent.py")
     else:
         print("="*80)
@@ -1,44 +1,94 @@
 # validator/arvo_data_loader.py - FINAL VERSION (Matches Your Schema)
 
-from .ssh_client import run_remote_command, ARVO_DB_PATH
+from .ssh_client import run_remote_command, ARVO_DB_PATH, ARVO_DB_PRAGMAS
+import functools
 import json
+import os
 import re
-from typing import Dict, Any, Optional
+import shlex
+from typing import Dict, Any, Optional, List
 
-def load_bug_data(local_id: int) -> Optional[Dict[str, Any]]:
-    """
-    Queries the ARVO DB on the remote VM via SSH and returns comprehensive bug entry.
+# Only the fields the workflow actually reads; wide text columns like report
+# are left on the VM to keep the SSH payload small
+BUG_DATA_COLUMNS = [
+    'localId',
+    'project',
+    'repo_addr',
+    'fix_commit',
+    'reproducer_vul',
+    'sanitizer',
+    'crash_type',
+    'crash_output',
+    'language',
+]
+
+# ASCII unit/record separators: rows come back as plain delimited text, which
+# is far cheaper to split than JSON-decoding the (often >10KB) crash_output
+FIELD_SEP = '\x1f'
+ROW_SEP = '\x1e'
+
+
+# On-disk memo of loaded bug entries, invalidated whenever the remote DB changes
+BUG_CACHE_DIR = os.path.expanduser("~/.cache/smart-patch-agent/arvo")
+BUG_CACHE_VERSION = 3  # Entries written by v2 may lack the crash-derived fields
+
+# orjson encodes/decodes the cache files faster, if installed
+try:
+    import orjson
+    _json_loads, _json_dumps = orjson.loads, orjson.dumps
+except ImportError:
+    _json_loads, _json_dumps = json.loads, lambda obj: json.dumps(obj).encode()
+
+# In-process memo on top of the disk cache: a retried or re-run bug in the same
+# process never touches disk or SSH again
+_bug_memo: Dict[int, Dict[str, Any]] = {}
+
+
+@functools.lru_cache(maxsize=1)
+def get_db_mtime() -> Optional[str]:
+    """Returns the remote ARVO DB mtime (one SSH call per process), or None."""
+    exit_code, stdout, _ = run_remote_command(f"stat -c %Y {ARVO_DB_PATH}")
+    mtime = stdout.strip()
+    return mtime if exit_code == 0 and mtime else None
+
+
+def _cache_get(local_id: int, mtime: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(BUG_CACHE_DIR, f"{local_id}.json"), 'rb') as f:
+            cached = _json_loads(f.read())
+    except (OSError, ValueError):
+        return None
     
-    Schema-verified columns (from your database):
-    - localId, project, reproducer_vul, reproducer_fix, fix_commit, repo_addr
-    - sanitizer, crash_type, crash_output, severity, report, language
-    - fuzz_target, fuzz_engine, patch_url, patch_located, verified
+    if cached.get('version') != BUG_CACHE_VERSION or cached.get('mtime') != mtime:
+        return None
+    return cached.get('bug_entry')
+
+
+def _cache_put(local_id: int, mtime: str, bug_entry: Dict[str, Any]) -> None:
+    try:
+        os.makedirs(BUG_CACHE_DIR, exist_ok=True)
+        with open(os.path.join(BUG_CACHE_DIR, f"{local_id}.json"), 'wb') as f:
+            f.write(_json_dumps({'version': BUG_CACHE_VERSION, 'mtime': mtime, 'bug_entry': bug_entry}))
+    except OSError as e:
+        print(f"[DATA LOADER] Warning: Could not write bug cache: {e}")
+
+
+def query_bug_rows(where_clause: str) -> Optional[List[Dict[str, Any]]]:
     """
-    
-    # Query ALL relevant fields from your actual schema
-    query = f"""SELECT 
-        localId,
-        project,
-        repo_addr,
-        fix_commit,
-        reproducer_vul,
-        reproducer_fix,
-        sanitizer,
-        crash_type,
-        crash_output,
-        language,
-        severity,
-        report,
-        patch_url,
-        fuzz_target,
-        fuzz_engine
+    Runs a SELECT of BUG_DATA_COLUMNS on the remote ARVO DB and returns the parsed
+    rows, or None if the query failed. NULL columns come back as ''.
+    """
+    query = f"""SELECT {', '.join(BUG_DATA_COLUMNS)}
     FROM arvo 
-    WHERE localId={local_id};"""
+    WHERE {where_clause};"""
     
-    # Use SQLite's -json output for easy parsing
-    remote_cmd = f"sqlite3 -json {ARVO_DB_PATH} \"{query}\""
+    # exec: the command's subshell becomes sqlite3 instead of forking it, and
+    # the SQL is passed as one shell-quoted argument
+    remote_cmd = (
+        f"exec sqlite3 -bail -separator $'\\x1f' -newline $'\\x1e' "
+        f"{shlex.quote(ARVO_DB_PATH)} {ARVO_DB_PRAGMAS} {shlex.quote(query)}"
+    )
     
-    print(f"[DATA LOADER] Querying ARVO DB for bug {local_id}...")
     exit_code, stdout, stderr = run_remote_command(remote_cmd)
     
     if exit_code != 0:
@@ -47,31 +97,57 @@ def load_bug_data(local_id: int) -> Optional[Dict[str, Any]]:
         print(f"   Stderr: {stderr}")
         return None
     
+    rows = []
+    for record in stdout.split(ROW_SEP):
+        if not record:
+            continue
+        values = record.split(FIELD_SEP)
+        # Trailing empty columns may have been stripped along with the output
+        values += [''] * (len(BUG_DATA_COLUMNS) - len(values))
+        row = dict(zip(BUG_DATA_COLUMNS, values))
+        row['localId'] = int(row['localId'])
+        rows.append(row)
+    return rows
+
+
+def add_derived_fields(bug_entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Adds bug_id and the crash-derived file/line/category fields to a DB row."""
+    bug_entry['bug_id'] = str(bug_entry['localId'])
+    
+    # Extract detailed crash context from crash_output
+    if bug_entry.get('crash_output'):
+        crash_context = extract_crash_context(bug_entry['crash_output'])
+        bug_entry['extracted_file_path'] = crash_context['file_path']
+        bug_entry['extracted_line_number'] = crash_context['line_number']
+        bug_entry['bug_category'] = crash_context['bug_category']
+    else:
+        # Fallback to crash_type if no crash_output
+        bug_entry['extracted_file_path'] = 'unknown'
+        bug_entry['extracted_line_number'] = '0'
+        bug_entry['bug_category'] = classify_bug_type(bug_entry.get('crash_type', ''))
+    
+    return bug_entry
+
+
+def load_bug_data(local_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Queries the ARVO DB on the remote VM via SSH and returns comprehensive bug entry.
+    
+    Schema-verified columns (from your database):
+    - localId, project, reproducer_vul, reproducer_fix, fix_commit, repo_addr
+    - sanitizer, crash_type, crash_output, severity, report, language
+    - fuzz_target, fuzz_engine, patch_url, patch_located, verified
+    """
+    print(f"[DATA LOADER] Querying ARVO DB for bug {local_id}...")
+    
     try:
-        # Parse JSON result
-        data = json.loads(stdout)
+        # Single-bug lookups share the batch query path
+        bug_entry = load_bug_data_batch([local_id]).get(int(local_id))
         
-        if not data:
+        if bug_entry is None:
             print(f"ERROR: No data found for bug ID {local_id}")
             return None
         
-        bug_entry = data[0]
-        
-        # Add derived/helper fields
-        bug_entry['bug_id'] = str(local_id)
-        
-        # Extract detailed crash context from crash_output
-        if bug_entry.get('crash_output'):
-            crash_context = extract_crash_context(bug_entry['crash_output'])
-            bug_entry['extracted_file_path'] = crash_context['file_path']
-            bug_entry['extracted_line_number'] = crash_context['line_number']
-            bug_entry['bug_category'] = crash_context['bug_category']
-        else:
-            # Fallback to crash_type if no crash_output
-            bug_entry['extracted_file_path'] = 'unknown'
-            bug_entry['extracted_line_number'] = '0'
-            bug_entry['bug_category'] = classify_bug_type(bug_entry.get('crash_type', ''))
-        
         # Log what we successfully loaded
         print(f"[DATA LOADER] ✅ Successfully loaded bug data:")
         print(f"   Project: {bug_entry.get('project', 'unknown')}")
@@ -86,11 +162,6 @@ def load_bug_data(local_id: int) -> Optional[Dict[str, Any]]:
         
         return bug_entry
         
-    except json.JSONDecodeError as e:
-        print(f"ERROR: Could not parse JSON data from DB query.")
-        print(f"   Error: {e}")
-        print(f"   Raw Output: {stdout[:500]}...")
-        return None
     except Exception as e:
         print(f"ERROR: Unexpected error loading bug data: {e}")
         import traceback
@@ -98,6 +169,98 @@ def load_bug_data(local_id: int) -> Optional[Dict[str, Any]]:
         return None
 
 
+def load_bug_data_batch(local_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Loads several bugs with a single remote query (one SSH round-trip instead of
+    one per bug). Returns {localId: bug_entry}; missing IDs are simply absent.
+    """
+    if not local_ids:
+        return {}
+    
+    bugs = {int(local_id): _bug_memo[int(local_id)] for local_id in local_ids if int(local_id) in _bug_memo}
+    if len(bugs) == len(local_ids):
+        return bugs
+    
+    # Serve what we can from the on-disk cache (valid for the current DB mtime)
+    mtime = get_db_mtime()
+    if mtime:
+        for local_id in local_ids:
+            if int(local_id) in bugs:
+                continue
+            cached = _cache_get(int(local_id), mtime)
+            if cached is not None:
+                bugs[int(local_id)] = _bug_memo[int(local_id)] = cached
+    
+    missing_ids = [int(local_id) for local_id in local_ids if int(local_id) not in bugs]
+    if not missing_ids:
+        print(f"[DATA LOADER] Loaded {len(bugs)} bug(s) from cache")
+        return bugs
+    
+    # IDs are coerced to int, so building the IN list directly is safe
+    ids_csv = ",".join(str(local_id) for local_id in missing_ids)
+    if len(missing_ids) > 1:
+        print(f"[DATA LOADER] Prefetching {len(missing_ids)} bugs from ARVO DB...")
+    
+    data = query_bug_rows(f"localId IN ({ids_csv})")
+    for row in data or []:
+        bug_entry = add_derived_fields(row)
+        bugs[row['localId']] = _bug_memo[row['localId']] = bug_entry
+        if mtime:
+            _cache_put(row['localId'], mtime, bug_entry)
+    
+    if len(local_ids) > 1:
+        print(f"[DATA LOADER] ✅ Prefetched {len(bugs)}/{len(local_ids)} bugs")
+    return bugs
+
+
+# Crash-log patterns, compiled once at import
+_FILE_LINE_RE = re.compile(r'([/\w\-_.]+\.(?:cpp|cc|c|h|hpp|java|py)):(\d+):\d+')
+_LINE_RE = re.compile(r':(\d+):\d+')
+_FUNC_RE = re.compile(r'#\d+\s+0x[\da-f]+\s+in\s+([^\s/]+)')
+_FRAME_RE = re.compile(
+    r'#0\s+0x[\da-f]+\s+in\s+(?P<func>[^\s/]+)\s+'
+    r'(?P<file>[/\w\-_.]+\.(?:cpp|cc|c|h|hpp|java|py)):(?P<line>\d+):\d+'
+)
+
+# Sanitizer keywords -> category, in order of precedence
+_CATEGORY_KEYWORDS = [
+    ('heap-buffer-overflow', 'HEAP_BUFFER_OVERFLOW'),
+    ('stack-buffer-overflow', 'STACK_BUFFER_OVERFLOW'),
+    ('global-buffer-overflow', 'GLOBAL_BUFFER_OVERFLOW'),
+    ('use-after-free', 'USE_AFTER_FREE'),
+    ('heap-use-after-free', 'USE_AFTER_FREE'),
+    ('double-free', 'DOUBLE_FREE'),
+    ('null', 'NULL_POINTER'),
+    ('segv', 'SEGMENTATION_FAULT'),
+    ('segmentation fault', 'SEGMENTATION_FAULT'),
+    ('stack-overflow', 'STACK_OVERFLOW'),
+    ('integer-overflow', 'INTEGER_OVERFLOW'),
+    ('undefined behavior', 'UNDEFINED_BEHAVIOR'),
+    ('assert', 'ASSERTION_FAILURE'),
+]
+# Longest keywords first so e.g. heap-use-after-free isn't cut short
+_CATEGORY_RE = re.compile(
+    '|'.join(re.escape(keyword) for keyword, _ in sorted(_CATEGORY_KEYWORDS, key=lambda kw: -len(kw[0]))),
+    re.IGNORECASE
+)
+
+
+# Bug category -> fix hint (see get_fix_hint)
+_FIX_HINTS = {
+    'HEAP_BUFFER_OVERFLOW': 'Add bounds check before array/buffer access',
+    'STACK_BUFFER_OVERFLOW': 'Add bounds check or increase buffer size',
+    'GLOBAL_BUFFER_OVERFLOW': 'Add bounds check for global array access',
+    'USE_AFTER_FREE': 'Check pointer validity before use or use smart pointers',
+    'DOUBLE_FREE': 'Ensure pointer is only freed once or set to NULL after free',
+    'NULL_POINTER': 'Add null pointer check before dereferencing',
+    'SEGMENTATION_FAULT': 'Add pointer validation before access',
+    'STACK_OVERFLOW': 'Limit recursion depth or reduce stack allocation',
+    'INTEGER_OVERFLOW': 'Add overflow checks before arithmetic operations',
+    'UNDEFINED_BEHAVIOR': 'Follow language standards for the operation',
+    'ASSERTION_FAILURE': 'Ensure assertion condition is satisfied',
+}
+
+
 def extract_crash_context(crash_output: str) -> Dict[str, str]:
     """
     Parse crash_output to extract file path, line number, and bug category.
@@ -119,57 +282,45 @@ def extract_crash_context(crash_output: str) -> Dict[str, str]:
     if not crash_output:
         return context
     
-    # Extract file path and line number from stack trace
-    # Pattern 1: /path/to/file.cpp:123:45 (ASAN format)
-    file_match = re.search(r'([/\w\-_.]+\.(cpp|cc|c|h|hpp|java|py)):\d+:\d+', crash_output)
-    if file_match:
-        full_path = file_match.group(1)
-        # Extract just the filename from the full path for simpler matching
-        # But keep the relative path if it's there
-        context['file_path'] = full_path
-    
-    # Extract line number
-    line_match = re.search(r':(\d+):\d+', crash_output)
-    if line_match:
-        context['line_number'] = line_match.group(1)
-    
-    # Extract function name from stack trace
-    # Pattern: #0 0x... in function_name /path/to/file.cpp:123
-    func_match = re.search(r'#\d+\s+0x[\da-f]+\s+in\s+([^\s/]+)', crash_output)
-    if func_match:
-        context['function_name'] = func_match.group(1)
-    
-    # Classify bug type from ASAN error message
-    crash_lower = crash_output.lower()
+    # Fast path: the top stack frame carries function, file and line together
+    # Pattern: #0 0x... in function_name /path/to/file.cpp:123:45
+    # (cheap substring probes skip the regex engine on logs without a stack trace)
+    frame_match = _FRAME_RE.search(crash_output) if '#0' in crash_output else None
+    if frame_match:
+        context['function_name'] = frame_match.group('func')
+        context['file_path'] = frame_match.group('file')
+        context['line_number'] = frame_match.group('line')
+    else:
+        # Extract file path and line number from stack trace in one pass
+        # Pattern: /path/to/file.cpp:123:45 (ASAN format)
+        file_match = _FILE_LINE_RE.search(crash_output) if ':' in crash_output else None
+        if file_match:
+            # Keep the full (possibly relative) path for later cleaning
+            context['file_path'] = file_match.group(1)
+            context['line_number'] = file_match.group(2)
+        elif ':' in crash_output:
+            # Line info without a recognised source extension
+            line_match = _LINE_RE.search(crash_output)
+            if line_match:
+                context['line_number'] = line_match.group(1)
+        
+        # Extract function name from stack trace
+        func_match = _FUNC_RE.search(crash_output) if '#' in crash_output else None
+        if func_match:
+            context['function_name'] = func_match.group(1)
     
-    if 'heap-buffer-overflow' in crash_lower:
-        context['bug_category'] = 'HEAP_BUFFER_OVERFLOW'
-    elif 'stack-buffer-overflow' in crash_lower:
-        context['bug_category'] = 'STACK_BUFFER_OVERFLOW'
-    elif 'global-buffer-overflow' in crash_lower:
-        context['bug_category'] = 'GLOBAL_BUFFER_OVERFLOW'
-    elif 'use-after-free' in crash_lower:
-        context['bug_category'] = 'USE_AFTER_FREE'
-    elif 'heap-use-after-free' in crash_lower:
-        context['bug_category'] = 'USE_AFTER_FREE'
-    elif 'double-free' in crash_lower:
-        context['bug_category'] = 'DOUBLE_FREE'
-    elif 'null' in crash_lower or 'nullptr' in crash_lower:
-        context['bug_category'] = 'NULL_POINTER'
-    elif 'segv' in crash_lower or 'segmentation fault' in crash_lower:
-        context['bug_category'] = 'SEGMENTATION_FAULT'
-    elif 'stack-overflow' in crash_lower:
-        context['bug_category'] = 'STACK_OVERFLOW'
-    elif 'integer-overflow' in crash_lower:
-        context['bug_category'] = 'INTEGER_OVERFLOW'
-    elif 'undefined behavior' in crash_lower:
-        context['bug_category'] = 'UNDEFINED_BEHAVIOR'
-    elif 'assertion' in crash_lower or 'assert' in crash_lower:
-        context['bug_category'] = 'ASSERTION_FAILURE'
+    # Classify bug type from ASAN error message: one scan collects every
+    # keyword present, then the highest-precedence category wins
+    found_keywords = {match.lower() for match in _CATEGORY_RE.findall(crash_output)}
+    for keyword, category in _CATEGORY_KEYWORDS:
+        if keyword in found_keywords:
+            context['bug_category'] = category
+            break
     
     return context
 
 
+@functools.lru_cache(maxsize=64)
 def classify_bug_type(crash_type: str) -> str:
     """
     Fallback classification based on crash_type field (if crash_output is unavailable).
@@ -193,22 +344,9 @@ def classify_bug_type(crash_type: str) -> str:
         return crash_type.upper().replace('-', '_').replace(' ', '_')
 
 
+@functools.lru_cache(maxsize=64)
 def get_fix_hint(bug_category: str) -> str:
     """
     Provide a hint for fixing each bug category.
     """
-    hints = {
-        'HEAP_BUFFER_OVERFLOW': 'Add bounds check before array/buffer access',
-        'STACK_BUFFER_OVERFLOW': 'Add bounds check or increase buffer size',
-        'GLOBAL_BUFFER_OVERFLOW': 'Add bounds check for global array access',
-        'USE_AFTER_FREE': 'Check pointer validity before use or use smart pointers',
-        'DOUBLE_FREE': 'Ensure pointer is only freed once or set to NULL after free',
-        'NULL_POINTER': 'Add null pointer check before dereferencing',
-        'SEGMENTATION_FAULT': 'Add pointer validation before access',
-        'STACK_OVERFLOW': 'Limit recursion depth or reduce stack allocation',
-        'INTEGER_OVERFLOW': 'Add overflow checks before arithmetic operations',
-        'UNDEFINED_BEHAVIOR': 'Follow language standards for the operation',
-        'ASSERTION_FAILURE': 'Ensure assertion condition is satisfied',
-    }
-    
-    return hints.get(bug_category, 'Analyze crash log to determine appropriate fix')
\ No newline at end of file
+    return _FIX_HINTS.get(bug_category, 'Analyze crash log to determine appropriate fix')
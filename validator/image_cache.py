@@ -0,0 +1,65 @@
+# validator/image_cache.py
+"""
+Warm the VM's docker image cache ahead of validation, so the first `docker run`
+of each bug doesn't pay for the image pull inside its (capped) docker slot.
+"""
+
+import shlex
+from typing import Iterable, Optional
+from .ssh_client import run_remote_command
+
+# `docker run` options that don't take a value; every other option does,
+# unless it is given as --opt=value
+_RUN_FLAGS_WITHOUT_VALUE = {
+    '--rm', '--init', '--privileged', '--interactive', '--tty', '--detach',
+    '-i', '-t', '-d', '-it', '-ti',
+}
+
+
+def vm_docker_command(reproducer_vul: str) -> str:
+    """The docker command run on the VM for an ARVO reproducer command."""
+    return reproducer_vul.replace("arvo:", "arvo-vul ")
+
+
+def docker_image_of(docker_cmd: str) -> Optional[str]:
+    """Image name of a `docker run ...` command, or None if it can't be found."""
+    try:
+        args = shlex.split(docker_cmd)
+    except ValueError:
+        return None
+    if 'run' not in args:
+        return None
+    
+    args = iter(args[args.index('run') + 1:])
+    for arg in args:
+        if not arg.startswith('-'):
+            return arg
+        if '=' not in arg and arg not in _RUN_FLAGS_WITHOUT_VALUE:
+            next(args, None)  # skip the option's value
+    return None
+
+
+def prefetch_images(reproducer_cmds: Iterable[str]) -> None:
+    """
+    Starts pulling (in the background, on the VM) every image used by
+    reproducer_cmds that isn't already present. Returns immediately.
+    """
+    images = sorted({
+        image for image in map(docker_image_of, map(vm_docker_command, reproducer_cmds))
+        if image
+    })
+    if not images:
+        return
+    
+    pulls = " ".join(
+        f"{{ docker image inspect {img} >/dev/null 2>&1 || docker pull -q {img}; }} &"
+        for img in map(shlex.quote, images)
+    )
+    # Detached, so the SSH connection is free again right away
+    prefetch_cmd = f"nohup sh -c {shlex.quote(pulls + ' wait')} >/dev/null 2>&1 &"
+    
+    exit_code, _, stderr = run_remote_command(prefetch_cmd)
+    if exit_code != 0:
+        print(f"[IMAGE CACHE] Could not start image prefetch: {stderr}")
+        return
+    print(f"[IMAGE CACHE] Prefetching {len(images)} docker image(s) on the VM")
@@ -0,0 +1,29 @@
+# validator/path_utils.py
+"""
+Normalization of source paths reported in sanitizer crash logs.
+"""
+
+import re
+
+# Leading noise in front of the repo-relative path: an optional /src/ mount
+# prefix, stray slashes and any number of ../ hops
+_CLEAN_RE = re.compile(r'^(?:/src/)?/*(?:\.\./)*')
+_CLEAN_KEEP_SRC_RE = re.compile(r'^/*(?:\.\./)*')
+
+
+def clean_crash_path(file_path: str, strip_src_prefix: bool = True) -> str:
+    """
+    Turns a crash-log path into a repo-relative one in a single pass.
+    
+    /src/skia/out/Fuzz/../../src/codec/SkSwizzler.cpp -> src/codec/SkSwizzler.cpp
+    ../src/codec/SkSwizzler.cpp                       -> src/codec/SkSwizzler.cpp
+    /src/codec/SkSwizzler.cpp                         -> codec/SkSwizzler.cpp
+    """
+    if not file_path:
+        return ""
+    
+    # Everything before the last /../ is build-directory noise
+    file_path = file_path.split('/../')[-1]
+    
+    pattern = _CLEAN_RE if strip_src_prefix else _CLEAN_KEEP_SRC_RE
+    return pattern.sub('', file_path, count=1)
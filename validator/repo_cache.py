@@ -0,0 +1,61 @@
+# validator/repo_cache.py
+"""
+Warm per-repository git mirrors on the VM. Each repo is cloned over the network
+once; every later checkout is a fast local clone that shares the mirror's objects.
+"""
+
+import hashlib
+import shlex
+from .ssh_client import VM_WORKSPACE
+
+MIRROR_ROOT = f"{VM_WORKSPACE}/_mirrors"
+
+
+def mirror_path(repo_addr: str) -> str:
+    """Location of the bare mirror for repo_addr on the VM."""
+    return f"{MIRROR_ROOT}/{hashlib.sha1(repo_addr.encode()).hexdigest()}.git"
+
+
+def ensure_mirror_cmd(repo_addr: str, need_commit: str = '') -> str:
+    """
+    Shell snippet that creates (or refreshes) the mirror of repo_addr. With
+    need_commit, an existing mirror that already has that commit is used as is
+    (no network fetch).
+    """
+    mirror = shlex.quote(mirror_path(repo_addr))
+    mirror_tmp = shlex.quote(mirror_path(repo_addr) + '.tmp')
+    mirror_lock = shlex.quote(mirror_path(repo_addr) + '.lock')
+    
+    # flock keeps concurrent bugs of the same project from racing on the
+    # mirror; a failed refresh falls back to the objects we already have
+    ensure_mirror = (
+        f"if [ -d {mirror} ]; then "
+        f"git -C {mirror} fetch --prune --quiet || true; "
+        f"else rm -rf {mirror_tmp} && "
+        f"git clone --mirror --quiet {shlex.quote(repo_addr)} {mirror_tmp} && "
+        f"mv {mirror_tmp} {mirror}; fi"
+    )
+    ensure_cmd = (
+        f"mkdir -p {shlex.quote(MIRROR_ROOT)} && "
+        f"flock {mirror_lock} sh -c {shlex.quote(ensure_mirror)}"
+    )
+    if not need_commit:
+        return ensure_cmd
+    
+    has_commit = f"git --git-dir={mirror} cat-file -e {shlex.quote(need_commit + '^{commit}')} 2>/dev/null"
+    return f"{{ {has_commit} || {{ {ensure_cmd}; }}; }}"
+
+
+def clone_from_mirror_cmd(repo_addr: str, dest: str, no_checkout: bool = False,
+                          need_commit: str = '') -> str:
+    """
+    Shell snippet that creates (or refreshes) the mirror of repo_addr and then
+    clones dest from it with --shared, so no objects are copied. no_checkout
+    skips writing a working tree (for callers that only read blobs); with
+    need_commit the mirror is only refreshed if it lacks that commit.
+    """
+    return (
+        f"{ensure_mirror_cmd(repo_addr, need_commit)} && "
+        f"git clone --shared --quiet {'--no-checkout ' if no_checkout else ''}"
+        f"{shlex.quote(mirror_path(repo_addr))} {shlex.quote(dest)}"
+    )
@@ -2,7 +2,16 @@
 
 import paramiko
 import os
-from typing import Tuple, Optional, Any
+import atexit
+import posixpath
+import queue
+import select
+import socket
+import threading
+import uuid
+import weakref
+from contextlib import contextmanager
+from typing import Tuple, Optional, Any, Iterator
 
 # --- Final Configuration (Using your verified details) ---
 FINAL_HOST = "cs-mir.cs.uic.edu" 
@@ -10,6 +19,15 @@ FINAL_USER = "sai"
 FINAL_PORT = 2027
 ARVO_DB_PATH = "/home/sai/smart_patch_agent/data/arvo.db" 
 
+# Read-side sqlite3 tuning (memory-mapped I/O, ~200MB page cache, in-memory
+# temp B-trees). Passed as leading sqlite3 arguments; output is silenced so the
+# PRAGMA result rows don't end up in front of the -json query output.
+ARVO_DB_PRAGMAS = (
+    '".output /dev/null" '
+    '"PRAGMA mmap_size=268435456; PRAGMA cache_size=-200000; PRAGMA temp_store=MEMORY;" '
+    '".output stdout"'
+)
+
 # Jump Host 1 Details
 JUMP_HOST_NAME = "bertvm.cs.uic.edu"
 JUMP_HOST_USER = "vjann3"
@@ -21,6 +39,11 @@ FINAL_PASSWORD = "ubuntu"
 # Target Workspace on the final host
 VM_WORKSPACE = "/home/sai/patch_agent_workspace" 
 
+# Pooled connections sit idle while an LLM call or another bug runs; keepalives
+# stop the jump host / firewalls from dropping them, which would cost a new
+# two-hop handshake on the next command
+SSH_KEEPALIVE_SECONDS = 30
+
 
 def create_final_ssh_client(
     jump_host: str, jump_user: str, jump_pass: str, 
@@ -53,6 +76,7 @@ def create_final_ssh_client(
             print(f"SSH ERROR: No transport available from jump host ({jump_host}).")
             jump_client.close()
             return None
+        transport.set_keepalive(SSH_KEEPALIVE_SECONDS)
         # Use transport.open_channel to request a direct-tcpip channel to the final host
         final_channel = transport.open_channel(
             "direct-tcpip",
@@ -77,6 +101,9 @@ def create_final_ssh_client(
             sock=final_channel, 
             timeout=30
         )
+        final_client.get_transport().set_keepalive(SSH_KEEPALIVE_SECONDS)
+        # The tunnel lives as long as the final client; _discard_client closes both
+        final_client.jump_client = jump_client
         print("SSH: Authentication successful on final host.")
         return final_client
     except Exception as e:
@@ -87,35 +114,284 @@ def create_final_ssh_client(
         return None
 
 
-def run_remote_command(command: str) -> Tuple[int, str, str]:
-    """Executes a command on the remote VM (cs-mir) via the bertvm jump host."""
+# --- Pipelined Command Session ---
+COMMAND_TIMEOUT = 180  # Seconds without any output before a command is abandoned
+
+# Output beyond this many bytes per stream (huge docker/build logs) is dropped
+# from the middle; a short tail is kept so the end of the log and our end
+# marker are never lost
+MAX_OUTPUT_BYTES = 8 << 20
+OUTPUT_TAIL_BYTES = 64 << 10
+TRUNCATION_NOTICE = b"\n[... output truncated ...]\n"
+
+
+class StreamBuffer:
+    """Accumulates one stream of a pipelined command up to its end marker."""
     
-    # Create the final client connection
-    ssh_client = create_final_ssh_client(
-        JUMP_HOST_NAME, JUMP_HOST_USER, JUMP_HOST_PASSWORD,
-        FINAL_HOST, FINAL_PORT, FINAL_USER, FINAL_PASSWORD
-    )
+    def __init__(self, end_marker: bytes):
+        self.data = bytearray()
+        self.end_marker = end_marker
+        self.marker_pos = -1
+        self.truncated = False
     
-    if ssh_client is None:
-        return 1, "", "Connection to final host failed during creation."
+    def feed(self, chunk: bytes) -> None:
+        # Only the newly received bytes (plus an overlap) need scanning
+        search_from = max(0, len(self.data) - len(self.end_marker))
+        self.data += chunk
+        if self.marker_pos < 0:
+            self.marker_pos = self.data.find(self.end_marker, search_from)
+        
+        if self.marker_pos < 0 and len(self.data) > MAX_OUTPUT_BYTES + OUTPUT_TAIL_BYTES:
+            del self.data[MAX_OUTPUT_BYTES:len(self.data) - OUTPUT_TAIL_BYTES]
+            self.truncated = True
     
-    print(f"SSH: Executing remote command: {command[:80]}...")
+    def raw_body(self) -> bytes:
+        body = bytes(self.data[:self.marker_pos])
+        if self.truncated:
+            body = body[:MAX_OUTPUT_BYTES] + TRUNCATION_NOTICE + body[MAX_OUTPUT_BYTES:]
+        return body.strip()
     
-    try:
-        # Execute the command on the final client
-        # Note: We are using a higher timeout (180s) for compilation/docker runs
-        stdin, stdout, stderr = ssh_client.exec_command(command, timeout=180) 
+    def body(self) -> str:
+        return self.raw_body().decode(errors='replace')
+    
+    def trailer(self) -> bytes:
+        return bytes(self.data[self.marker_pos + len(self.end_marker):])
+
+
+class PipelinedSession:
+    """
+    Runs many commands over one long-lived `bash -s` channel instead of opening
+    a new session channel per command. Each command runs in its own subshell
+    (so `cd` and `exit` don't leak into the next one) with stdin from /dev/null,
+    and is followed by a unique end marker on stdout (carrying the exit status)
+    and on stderr.
+    """
+    
+    def __init__(self, client: paramiko.SSHClient):
+        transport = client.get_transport()
+        if transport is None:
+            raise paramiko.SSHException("No transport available for pipelined session")
+        self.channel = transport.open_session()
+        self.channel.exec_command("bash -s")
+    
+    def is_active(self) -> bool:
+        return not self.channel.closed and not self.channel.exit_status_ready()
+    
+    def run(self, command: str) -> Tuple[int, str, str]:
+        exit_code, stdout, stderr = self.run_bytes(command)
+        return exit_code, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+    
+    def run_bytes(self, command: str) -> Tuple[int, bytes, bytes]:
+        """Like run(), but returns stdout/stderr undecoded."""
+        marker = uuid.uuid4().hex
+        self.channel.sendall(
+            f"(\n{command}\n) < /dev/null\n"
+            f"printf '\\n{marker} %s\\n' $?; printf '\\n{marker}\\n' >&2\n".encode()
+        )
+        
+        out = StreamBuffer(f"\n{marker} ".encode())
+        err = StreamBuffer(f"\n{marker}\n".encode())
         
-        output = stdout.read().decode().strip()
-        error = stderr.read().decode().strip()
-        exit_code = stdout.channel.recv_exit_status()
+        # Both streams are drained as data arrives, so a chatty stderr can never
+        # fill its window and stall stdout (and vice versa)
+        while True:
+            out_done = out.marker_pos >= 0 and out.data.endswith(b"\n")
+            if out_done and err.marker_pos >= 0:
+                break
+            if self.channel.exit_status_ready() and not self.channel.recv_ready():
+                raise paramiko.SSHException("Remote shell exited unexpectedly")
+            
+            # The channel is readable when either stdout or stderr has data
+            readable, _, _ = select.select([self.channel], [], [], COMMAND_TIMEOUT)
+            if not readable:
+                raise socket.timeout(f"No output for {COMMAND_TIMEOUT}s")
+            while self.channel.recv_ready():
+                out.feed(self.channel.recv(65536))
+            while self.channel.recv_stderr_ready():
+                err.feed(self.channel.recv_stderr(65536))
         
-        return exit_code, output, error
+        return int(out.trailer().strip()), out.raw_body(), err.raw_body()
+    
+    def close(self) -> None:
+        self.channel.close()
 
-    except Exception as e:
-        print(f"SSH ERROR: Failed to execute command on final host: {e}")
-        return 1, "", str(e)
+
+# One pipelined session per pooled client (clients are used by one thread at a time)
+_sessions: "weakref.WeakKeyDictionary[paramiko.SSHClient, PipelinedSession]" = weakref.WeakKeyDictionary()
+_sessions_lock = threading.Lock()
+
+
+def get_pipelined_session(client: paramiko.SSHClient) -> PipelinedSession:
+    """Returns the client's pipelined session, opening a new one if needed."""
+    with _sessions_lock:
+        session = _sessions.get(client)
+    
+    if session is None or not session.is_active():
+        session = PipelinedSession(client)
+        with _sessions_lock:
+            _sessions[client] = session
+    return session
+
+
+# --- Connection Pool ---
+# Up to SSH_POOL_SIZE authenticated connections are kept open and handed out
+# to run_remote_command callers, so concurrent workers never share a channel
+# and nobody pays the multi-hop handshake more than once per connection.
+SSH_POOL_SIZE = 4
+
+_idle_clients: "queue.Queue[paramiko.SSHClient]" = queue.Queue()
+_pool_lock = threading.Lock()
+_open_clients = 0
+
+
+def _is_alive(client: paramiko.SSHClient) -> bool:
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+def _discard_client(client: paramiko.SSHClient) -> None:
+    global _open_clients
+    for connection in (client, getattr(client, 'jump_client', None)):
+        try:
+            if connection is not None:
+                connection.close()
+        except Exception:
+            pass
+    with _pool_lock:
+        _open_clients -= 1
+
+
+def acquire_ssh_client() -> Optional[paramiko.SSHClient]:
+    """
+    Takes an idle connection from the pool, opening a new one if the pool is
+    not full yet, or blocking until another caller releases one.
+    """
+    global _open_clients
     
+    while True:
+        try:
+            client = _idle_clients.get_nowait()
+        except queue.Empty:
+            with _pool_lock:
+                can_open = _open_clients < SSH_POOL_SIZE
+                if can_open:
+                    _open_clients += 1
+            
+            if not can_open:
+                client = _idle_clients.get()
+            else:
+                client = create_final_ssh_client(
+                    JUMP_HOST_NAME, JUMP_HOST_USER, JUMP_HOST_PASSWORD,
+                    FINAL_HOST, FINAL_PORT, FINAL_USER, FINAL_PASSWORD
+                )
+                if client is None:
+                    with _pool_lock:
+                        _open_clients -= 1
+                return client
+        
+        if _is_alive(client):
+            return client
+        # Stale connection, drop it and try again
+        _discard_client(client)
+
+
+def release_ssh_client(client: paramiko.SSHClient, healthy: bool = True) -> None:
+    """Returns a connection to the pool, or closes it if it is broken."""
+    if healthy and _is_alive(client):
+        _idle_clients.put(client)
+    else:
+        _discard_client(client)
+
+
+@contextmanager
+def pooled_ssh_client() -> Iterator[Optional[paramiko.SSHClient]]:
+    """
+    Context manager around acquire_ssh_client/release_ssh_client. The client
+    goes back to the pool on normal exit and is discarded if the body raised,
+    since the connection may be broken.
+    """
+    client = acquire_ssh_client()
+    healthy = True
+    try:
+        yield client
+    except Exception:
+        healthy = False
+        raise
     finally:
-        # Ensure the client and all associated channels are closed
-        ssh_client.close()
\ No newline at end of file
+        if client is not None:
+            release_ssh_client(client, healthy)
+
+
+def close_ssh_pool() -> None:
+    """Closes every idle pooled connection (registered with atexit)."""
+    while True:
+        try:
+            client = _idle_clients.get_nowait()
+        except queue.Empty:
+            break
+        _discard_client(client)
+
+
+atexit.register(close_ssh_pool)
+
+
+def _sftp_makedirs(sftp: paramiko.SFTPClient, remote_dir: str) -> None:
+    """mkdir -p over SFTP."""
+    missing = []
+    while remote_dir not in ('', '/'):
+        try:
+            sftp.stat(remote_dir)
+            break
+        except IOError:
+            missing.append(remote_dir)
+            remote_dir = posixpath.dirname(remote_dir)
+    
+    for path in reversed(missing):
+        sftp.mkdir(path)
+
+
+def sftp_put_bytes(remote_path: str, data: bytes) -> None:
+    """
+    Writes raw bytes to a file on the remote VM over SFTP on a pooled connection,
+    creating parent directories as needed. Raises on failure.
+    """
+    with pooled_ssh_client() as ssh_client:
+        if ssh_client is None:
+            raise paramiko.SSHException("Connection to final host failed during creation.")
+        
+        sftp = ssh_client.open_sftp()
+        try:
+            _sftp_makedirs(sftp, posixpath.dirname(remote_path))
+            with sftp.open(remote_path, 'wb') as f:
+                f.write(data)
+        finally:
+            sftp.close()
+
+
+def run_remote_command(command: str) -> Tuple[int, str, str]:
+    """Executes a command on the remote VM (cs-mir) via the bertvm jump host."""
+    exit_code, stdout, stderr = run_remote_command_bytes(command)
+    return exit_code, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+
+def run_remote_command_bytes(command: str) -> Tuple[int, bytes, bytes]:
+    """
+    Same as run_remote_command, but stdout/stderr come back as raw bytes, for
+    callers that scan large outputs and only need to decode a small part.
+    """
+    
+    try:
+        # Borrow a pooled connection (created on first use)
+        with pooled_ssh_client() as ssh_client:
+            if ssh_client is None:
+                return 1, b"", b"Connection to final host failed during creation."
+            
+            print(f"SSH: Executing remote command: {command[:80]}...")
+            
+            # Execute the command over the client's long-lived shell channel
+            # Note: We are using a higher timeout (180s) for compilation/docker runs
+            return get_pipelined_session(ssh_client).run_bytes(command)
+
+    except Exception as e:
+        print(f"SSH ERROR: Failed to execute command on final host: {e}")
+        return 1, b"", str(e).encode()
@@ -1,12 +1,51 @@
 # validator/validator_interface.py
 
-from typing import Dict, Any, Literal
-from .ssh_client import run_remote_command, VM_WORKSPACE
+from typing import Dict, Any, List
+from .ssh_client import run_remote_command, run_remote_command_bytes, sftp_put_bytes, VM_WORKSPACE
+from .repo_cache import clone_from_mirror_cmd
+from .image_cache import vm_docker_command
 import re
-import base64
+import shlex
+import threading
+import uuid
 
 ValidatorResult = Dict[str, Any]
 
+# Exit codes of the combined setup/patch script, one per stage
+SETUP_FAILED_EXIT = 10
+PATCH_APPLY_FAILED_EXIT = 30
+
+# Concurrent validations (run_batch workers) share one VM; more simultaneous
+# docker builds than this just thrash its CPU and disk
+MAX_CONCURRENT_DOCKER_RUNS = 2
+_docker_slots = threading.BoundedSemaphore(MAX_CONCURRENT_DOCKER_RUNS)
+
+# Any of these in the PoC output means the bug still reproduces. Matched
+# against the raw bytes, so the (possibly MBs of) output is never decoded whole
+CRASH_MARKER_RE = re.compile(
+    rb'AddressSanitizer|UndefinedBehaviorSanitizer|Segmentation fault|SIGSEGV|ERROR',
+    re.IGNORECASE
+)
+# Lines of docker output (stdout, then stderr) returned as poc_output
+POC_OUTPUT_TAIL_LINES = 500
+# Bytes from the end of docker's stderr returned as compile_log
+COMPILE_LOG_TAIL_BYTES = 16 << 10
+# Patches smaller than this travel inside the setup script as a heredoc;
+# larger ones are uploaded over SFTP first
+PATCH_HEREDOC_MAX_BYTES = 4096
+
+
+def _tail_lines(data: bytes, count: int) -> List[bytes]:
+    """Last `count` lines of data, found by scanning back from the end."""
+    if count <= 0:
+        return []
+    pos = len(data)
+    for _ in range(count):
+        pos = data.rfind(b'\n', 0, pos)
+        if pos < 0:
+            break
+    return data[pos + 1:].splitlines()[-count:]
+
 def run_validation(
     bug_id: str,
     repo_addr: str,
@@ -32,90 +71,115 @@ def run_validation(
     workspace_path = f"{VM_WORKSPACE}/{bug_id}"
     repo_path = f"{workspace_path}/repo_dir"
     
-    def critical_failure(reason: str, log: str) -> ValidatorResult:
+    def critical_failure(reason: str, log: str, checked_out_commit: str = '') -> ValidatorResult:
         print(f"CRITICAL VALIDATION FAILURE: {reason}")
         return {
             'compiled': False,
             'poc_crash_detected': True,
             'functional_tests_passed': False,
             'poc_output': log,
-            'compile_log': log
+            'compile_log': log,
+            'checked_out_commit': checked_out_commit
         }
 
-    # SETUP: Clean Workspace, Clone, and Checkout
-    setup_and_checkout_cmd = f"""
-    mkdir -p {workspace_path} && cd {workspace_path} && 
-    
-    rm -rf repo_dir && 
-    
-    git clone {repo_addr} {repo_path} &&
-    cd {repo_path} &&
-    git checkout {buggy_commit}
-    """
-    exit_code, stdout, stderr = run_remote_command(setup_and_checkout_cmd)
-    if exit_code != 0:
-        return critical_failure(
-            "Git Checkout Failed",
-            f"Git clone/checkout failed. Exit Code: {exit_code}. Stderr: {stderr}"
-        )
-
-    # PATCH APPLICATION
     # Clean the patch diff
     patch_diff_clean = patch_diff.replace('```diff', '').replace('```', '').strip()
     
-    # Write patch to a temp file on the VM to avoid shell escaping issues
+    # The patch file lives outside repo_dir, so the re-clone below leaves it alone
     patch_file = f"{workspace_path}/current.patch"
     
-    # Encode patch as base64 to safely transfer
-    import base64
-    patch_b64 = base64.b64encode(patch_diff_clean.encode()).decode()
+    # Values from the DB/VM are shell-quoted before they go into the scripts
+    workspace_q = shlex.quote(workspace_path)
+    repo_q = shlex.quote(repo_path)
+    patch_file_q = shlex.quote(patch_file)
+    
+    # Small patches (the common case) are written by a quoted heredoc in the
+    # setup script itself, which saves the separate SFTP round-trip; the random
+    # terminator can't clash with a line of the patch
+    heredoc_marker = f"PATCH_EOF_{uuid.uuid4().hex}"
+    patch_bytes = patch_diff_clean.encode()
+    if len(patch_bytes) < PATCH_HEREDOC_MAX_BYTES and heredoc_marker not in patch_diff_clean:
+        write_patch_cmd = (
+            f"cat > {patch_file_q} <<'{heredoc_marker}' || exit {SETUP_FAILED_EXIT}\n"
+            f"{patch_diff_clean}\n"
+            f"{heredoc_marker}\n"
+        )
+    else:
+        # Stream the raw patch bytes to the VM over SFTP (no shell escaping,
+        # no base64 expansion)
+        write_patch_cmd = ""
+        try:
+            sftp_put_bytes(patch_file, patch_bytes)
+        except Exception as e:
+            return critical_failure(
+                "Patch Write Failed",
+                f"Could not write patch file. Error: {e}"
+            )
+    
+    # SETUP + PATCH APPLICATION in one remote script (one SSH round-trip).
+    # Each stage exits with its own code so failures are still reported per stage.
     
-    write_patch_cmd = f"""
-    echo "{patch_b64}" | base64 -d > {patch_file}
-    """
+    # `git apply --check` picks the strip level without touching the tree; if the
+    # diff doesn't apply exactly at either level, GNU patch gets a go (it tolerates
+    # offsets/fuzz), where a strip level counts as applied if patch exits 0 or
+    # reports a succeeded hunk
+    setup_and_patch_cmd = f"""
+    {{ mkdir -p {workspace_q} && cd {workspace_q} && 
     
-    write_exit, write_out, write_err = run_remote_command(write_patch_cmd)
-    if write_exit != 0:
-        return critical_failure(
-            "Patch Write Failed",
-            f"Could not write patch file. Stderr: {write_err}"
-        )
+    rm -rf repo_dir && 
     
-    # Apply the patch
-    apply_patch_cmd = f"""
-    cd {repo_path} &&
-    patch -p1 --batch --forward < {patch_file}
+    {clone_from_mirror_cmd(repo_addr, repo_path, need_commit=buggy_commit)} &&
+    cd {repo_q} &&
+    git checkout {shlex.quote(buggy_commit)}; }} || exit {SETUP_FAILED_EXIT}
+    
+{write_patch_cmd}
+    apply_patch() {{
+        out=$(patch -p$1 --batch --forward < {patch_file_q}); rc=$?
+        echo "$out"
+        [ $rc -eq 0 ] || echo "$out" | grep -qi succeeded
+    }}
+    if git apply --check -p1 {patch_file_q} 2>/dev/null; then
+        git apply -p1 {patch_file_q} || exit {PATCH_APPLY_FAILED_EXIT}
+    elif git apply --check -p0 {patch_file_q} 2>/dev/null; then
+        git apply -p0 {patch_file_q} || exit {PATCH_APPLY_FAILED_EXIT}
+    else
+        apply_patch 1 || apply_patch 0 || exit {PATCH_APPLY_FAILED_EXIT}
+    fi
     """
-    patch_exit_code, patch_stdout, patch_stderr = run_remote_command(apply_patch_cmd)
-    
-    # Check if patch applied successfully
-    if patch_exit_code != 0 and 'succeeded' not in patch_stdout.lower():
-        # Try with different strip level
-        apply_patch_cmd_p0 = f"""
-        cd {repo_path} &&
-        patch -p0 --batch --forward < {patch_file}
-        """
-        patch_exit_code, patch_stdout, patch_stderr = run_remote_command(apply_patch_cmd_p0)
-        
-        if patch_exit_code != 0 and 'succeeded' not in patch_stdout.lower():
-            return critical_failure(
-                "Patch Apply Failed",
-                f"Patch failed to apply cleanly.\nStdout: {patch_stdout}\nStderr: {patch_stderr}"
-            )
+    exit_code, stdout, stderr = run_remote_command(setup_and_patch_cmd)
+    if exit_code == PATCH_APPLY_FAILED_EXIT:
+        return critical_failure(
+            "Patch Apply Failed",
+            f"Patch failed to apply cleanly.\nStdout: {stdout}\nStderr: {stderr}",
+            checked_out_commit=buggy_commit
+        )
+    if exit_code != 0:
+        return critical_failure(
+            "Git Checkout Failed",
+            f"Git clone/checkout failed. Exit Code: {exit_code}. Stderr: {stderr}"
+        )
         
     # DOCKER EXECUTION (Build and Run PoC)
-    docker_cmd = reproducer_vul.replace("arvo:", "arvo-vul ")
+    docker_cmd = vm_docker_command(reproducer_vul)
     
     full_docker_command = f"""
-    cd {workspace_path} && 
-    {docker_cmd} --rm -v {repo_path}:/src 
+    cd {workspace_q} && 
+    {docker_cmd} --rm -v {shlex.quote(repo_path + ':/src')} 
     """
     
-    docker_exit_code, docker_output, docker_stderr = run_remote_command(full_docker_command)
+    # Setup above overlaps freely across bugs; the builds themselves are capped
+    with _docker_slots:
+        docker_exit_code, docker_output, docker_stderr = run_remote_command_bytes(full_docker_command)
     
     # RESULT ANALYSIS
-    full_output = docker_output + docker_stderr
-    poc_crash_detected = bool(re.search(r'(AddressSanitizer|UndefinedBehaviorSanitizer|Segmentation fault|SIGSEGV|ERROR)', full_output, re.IGNORECASE))
+    # Each stream is scanned on its own (sanitizer reports go to stderr, so it
+    # is checked first) instead of building one concatenated copy
+    poc_crash_detected = bool(CRASH_MARKER_RE.search(docker_stderr) or CRASH_MARKER_RE.search(docker_output))
+    
+    # Only the tail of the run (where the sanitizer report ends up) is kept as
+    # the log, and only that tail is decoded
+    err_tail = _tail_lines(docker_stderr, POC_OUTPUT_TAIL_LINES)
+    poc_tail = _tail_lines(docker_output, POC_OUTPUT_TAIL_LINES - len(err_tail)) + err_tail
     
     compiled_successfully = docker_exit_code == 0 or poc_crash_detected 
     
@@ -123,11 +187,13 @@ def run_validation(
     
     final_result: ValidatorResult = {
         'compiled': compiled_successfully,
-        'compile_log': docker_stderr,
+        'compile_log': docker_stderr[-COMPILE_LOG_TAIL_BYTES:].decode(errors='replace'),
         'poc_crash_detected': poc_crash_detected,
         'functional_tests_passed': functional_tests_passed,
-        'poc_output': full_output,
-        'duration_seconds': 0.0
+        'poc_output': b'\n'.join(poc_tail).decode(errors='replace'),
+        'duration_seconds': 0.0,
+        # repo_dir holds a clone of this commit (with the patch applied)
+        'checked_out_commit': buggy_commit
     }
     
     print("[VALIDATOR INTERFACE]: Validation complete.")
@@ -0,0 +1,113 @@
+# workflow/batch_generation.py
+"""
+Offline generation of the initial patches for a whole batch of bugs through
+the Mistral Batch API: one uploaded JSONL job instead of one chat call per bug.
+"""
+
+import json
+import time
+from typing import Any, Dict, Optional
+from . import nodes
+from .io_pool import IO_POOL
+
+BATCH_POLL_SECONDS = 10
+# Past this the job is abandoned and the graph generates patches one by one
+BATCH_TIMEOUT_SECONDS = 60 * 60
+BATCH_TERMINAL_STATUSES = {'SUCCESS', 'FAILED', 'TIMEOUT_EXCEEDED', 'CANCELLED'}
+
+
+def _build_initial_prompt(bug_data: Dict[str, Any]) -> Optional[str]:
+    """Same prompt lightweight_patch_generator_node builds, or None if it won't call Codestral."""
+    analysis = nodes.analyze_bug_from_data(bug_data)
+    if analysis['bug_type'] in nodes.FAST_PATH_BUG_TYPES:
+        return None
+    line_num = int(analysis['line_number']) if analysis['line_number'].isdigit() else 0
+    actual_code = nodes.fetch_code_from_repo(bug_data, line_num, context_lines=nodes.INITIAL_CONTEXT_LINES)
+    if not actual_code:
+        return None
+    
+    return nodes.create_patch_prompt(
+        code=actual_code,
+        file_path=analysis['file_path'],
+        line_number=analysis['line_number'],
+        bug_type=analysis['bug_type'],
+        language=analysis['language']
+    )
+
+
+def batch_lightweight_generate(bug_datas: Dict[int, Dict[str, Any]]) -> Dict[int, str]:
+    """
+    Generates the initial patch of every bug in one Batch API job.
+    
+    Returns {bug_id: cleaned patch} for the bugs the job answered; bugs that are
+    missing (no code, failed request, job error) are left to the graph's own
+    lightweight_patch_generator_node.
+    """
+    client = nodes.client
+    if client is None or nodes.llm_blocked or not bug_datas:
+        return {}
+    
+    # The code fetches run concurrently (as far as the SSH pool allows)
+    prompts = dict(zip(bug_datas, IO_POOL.map(_build_initial_prompt, bug_datas.values())))
+    
+    # Same sampling settings as the interactive call in lightweight_patch_generator_node;
+    # there is no second, larger request here, so the retry budget is used up front
+    requests = [
+        json.dumps({
+            "custom_id": str(bug_id),
+            "body": {
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.3,
+                "max_tokens": nodes.PATCH_RETRY_MAX_TOKENS
+            }
+        })
+        for bug_id, prompt in prompts.items() if prompt
+    ]
+    if not requests:
+        return {}
+    
+    try:
+        print(f"[BATCH GEN] Submitting {len(requests)} prompts as one batch job...")
+        input_file = client.files.upload(
+            file={"file_name": "patch_initial.jsonl", "content": "\n".join(requests).encode()},
+            purpose="batch"
+        )
+        job = client.batch.jobs.create(
+            input_files=[input_file.id],
+            model=nodes.MODEL,
+            endpoint="/v1/chat/completions"
+        )
+        
+        deadline = time.monotonic() + BATCH_TIMEOUT_SECONDS
+        while job.status not in BATCH_TERMINAL_STATUSES:
+            if time.monotonic() > deadline:
+                print(f"[BATCH GEN] Job {job.id} still {job.status} after {BATCH_TIMEOUT_SECONDS}s; giving up")
+                client.batch.jobs.cancel(job_id=job.id)
+                return {}
+            time.sleep(BATCH_POLL_SECONDS)
+            job = client.batch.jobs.get(job_id=job.id)
+        
+        print(f"[BATCH GEN] Job {job.id} finished: {job.status}")
+        if not job.output_file:
+            return {}
+        output = client.files.download(file_id=job.output_file).read().decode()
+    
+    except Exception as e:
+        print(f"[BATCH GEN] Batch job failed: {e}")
+        nodes.mark_llm_blocked_if_rejected(e)
+        return {}
+    
+    patches = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            raw_patch = entry['response']['body']['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError, TypeError):
+            continue
+        if raw_patch:
+            patches[int(entry['custom_id'])] = nodes.clean_codestral_response(raw_patch)
+    
+    print(f"[BATCH GEN] Got {len(patches)}/{len(requests)} patches from the batch job")
+    return patches
@@ -0,0 +1,20 @@
+# workflow/bootstrap.py
+"""
+Process-wide singletons shared by the entry scripts (run_agent, run_batch, quick_test).
+"""
+
+import functools
+from .graph_builder import build_patch_agent_graph
+from .nodes import init_network_clients
+
+@functools.lru_cache(maxsize=1)
+def get_app():
+    """
+    Returns the compiled patch agent graph, building it on first use only.
+    The nodes' network clients are opened here too, not at import.
+    
+    SSH connections need no equivalent here: validator.ssh_client already
+    keeps a process-wide pool shared by every run_remote_command caller.
+    """
+    init_network_clients()
+    return build_patch_agent_graph()
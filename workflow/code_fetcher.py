@@ -3,10 +3,14 @@
 Fetch actual source code from the repository to provide real context.
 """
 
-from validator.ssh_client import run_remote_command, VM_WORKSPACE
+from validator.ssh_client import run_remote_command
+from validator.repo_cache import ensure_mirror_cmd, mirror_path
 from typing import Dict, Optional, Tuple
-import re
+import functools
+import shlex
+import posixpath
 
+@functools.lru_cache(maxsize=1024)
 def clean_file_path(file_path: str) -> str:
     """
     Clean up file paths from ASAN output.
@@ -22,23 +26,8 @@ def clean_file_path(file_path: str) -> str:
     if file_path.startswith('/src/'):
         file_path = file_path[5:]
     
-    # Handle ../ patterns by resolving them
-    parts = file_path.split('/')
-    resolved = []
-    
-    for part in parts:
-        if part == '..':
-            if resolved:
-                resolved.pop()
-        elif part and part != '.':
-            resolved.append(part)
-    
-    result = '/'.join(resolved)
-    
-    # Remove leading slash
-    result = result.lstrip('/')
-    
-    return result
+    # Resolve ./ and ../ in C; anchoring at / makes ../ past the top a no-op
+    return posixpath.normpath('/' + file_path).lstrip('/')
 
 
 def fetch_code_context(bug_data: Dict, line_number: int, context_lines: int = 15) -> Optional[Tuple[str, str]]:
@@ -53,7 +42,6 @@ def fetch_code_context(bug_data: Dict, line_number: int, context_lines: int = 15
     Returns:
         Tuple of (code_with_line_numbers, actual_file_path) or None if fetch fails
     """
-    bug_id = bug_data.get('bug_id', 'unknown')
     repo_url = bug_data.get('repo_addr')
     commit_hash = bug_data.get('fix_commit')
     file_path = bug_data.get('extracted_file_path', '')
@@ -69,80 +57,53 @@ def fetch_code_context(bug_data: Dict, line_number: int, context_lines: int = 15
         print(f"[CODE FETCHER] Could not clean file path: {file_path}")
         return None
     
-    workspace = f"{VM_WORKSPACE}/{bug_id}"
-    repo_dir = f"{workspace}/repo_dir"
-    
     print(f"[CODE FETCHER] Fetching code from {cleaned_path} at line {line_number}")
     
-    # Command to:
-    # 1. Clone repo if needed
-    # 2. Checkout the buggy commit (parent of fix commit)
-    # 3. Extract lines around the bug
+    # One remote script:
+    # 1. Make sure the project's mirror on the VM has the commit (no per-bug clone:
+    #    files are read from the mirror's object store)
+    # 2. Resolve the buggy commit (parent of fix commit)
+    # 3. Locate the file in that commit's tree (falling back to a search by basename)
+    # 4. Print a PATH: header, then the lines around the bug via git show
+    # Values from the DB/crash log are shell-quoted before they go into the script
+    line_number, context_lines = int(line_number), int(context_lines)
+    
     fetch_cmd = f"""
-        mkdir -p {workspace} &&
-        cd {workspace} &&
-        
-        if [ ! -d "repo_dir" ]; then
-            git clone {repo_url} repo_dir 2>&1
-        fi &&
-        
-        cd repo_dir &&
+        {{ {ensure_mirror_cmd(repo_url, commit_hash)}; }} >&2 &&
+        export GIT_DIR={shlex.quote(mirror_path(repo_url))} &&
         
-        git checkout {commit_hash}~1 2>/dev/null || git checkout {commit_hash} &&
+        REV=$(git rev-parse -q --verify {shlex.quote(commit_hash + '~1^{commit}')} || git rev-parse -q --verify {shlex.quote(commit_hash + '^{commit}')}) &&
         
-        if [ ! -f "{cleaned_path}" ]; then
-            echo "ERROR: File not found: {cleaned_path}"
-            find . -name "$(basename {cleaned_path})" -type f | head -1
+        FILE={shlex.quote(cleaned_path)} &&
+        if ! git cat-file -e "$REV:$FILE" 2>/dev/null; then
+            BASE=$(basename "$FILE")
+            FILE=$(git ls-tree -r --name-only "$REV" | awk -v b="$BASE" '$0 == b || substr($0, length($0) - length(b)) == "/" b {{ print; exit }}')
+        fi &&
+        if [ -z "$FILE" ]; then
+            echo "ERROR: File not found: $FILE" >&2
             exit 1
         fi &&
+        echo "PATH:$FILE" &&
         
-        total_lines=$(wc -l < "{cleaned_path}") &&
         start_line=$(({line_number} - {context_lines})) &&
         end_line=$(({line_number} + {context_lines})) &&
         
         if [ $start_line -lt 1 ]; then start_line=1; fi &&
-        if [ $end_line -gt $total_lines ]; then end_line=$total_lines; fi &&
         
-        sed -n "${{start_line}},${{end_line}}p" "{cleaned_path}" | nl -v $start_line -w 4 -s " | "
+        git show "$REV:$FILE" | sed -n "${{start_line}},${{end_line}}p" | nl -ba -v $start_line -w 4 -s " | "
     """
     
     exit_code, stdout, stderr = run_remote_command(fetch_cmd)
     
-    found_path = cleaned_path
-    
     if exit_code != 0:
         print(f"[CODE FETCHER] Failed to fetch code: {stderr}")
-        
-        # Try to find the file by basename
-        basename = cleaned_path.split('/')[-1]
-        find_cmd = f"cd {repo_dir} && find . -name '{basename}' -type f | head -1"
-        find_exit, find_out, find_err = run_remote_command(find_cmd)
-        
-        if find_exit == 0 and find_out.strip():
-            found_path = find_out.strip().lstrip('./')
-            print(f"[CODE FETCHER] Found file at: {found_path}, retrying...")
-            
-            # Retry with found path
-            retry_cmd = f"""
-                cd {repo_dir} &&
-                total_lines=$(wc -l < "{found_path}") &&
-                start_line=$(({line_number} - {context_lines})) &&
-                end_line=$(({line_number} + {context_lines})) &&
-                
-                if [ $start_line -lt 1 ]; then start_line=1; fi &&
-                if [ $end_line -gt $total_lines ]; then end_line=$total_lines; fi &&
-                
-                sed -n "${{start_line}},${{end_line}}p" "{found_path}" | nl -v $start_line -w 4 -s " | "
-            """
-            
-            retry_exit, retry_out, retry_err = run_remote_command(retry_cmd)
-            if retry_exit == 0:
-                stdout = retry_out
-                exit_code = 0
-            else:
-                return None
-        else:
-            return None
+        return None
+    
+    # Everything after the PATH: header is the numbered code
+    header, _, stdout = stdout.partition("PATH:")[2].partition("\n")
+    found_path = header.strip() or cleaned_path
+    if found_path != cleaned_path:
+        print(f"[CODE FETCHER] Found file at: {found_path}")
     
     if not stdout or len(stdout.strip()) < 10:
         print(f"[CODE FETCHER] No code returned")
@@ -160,9 +121,13 @@ def format_code_for_prompt(code_with_lines: str, target_line: int) -> str:
     lines = code_with_lines.splitlines()
     formatted_lines = []
     
+    # nl right-justifies the number and follows it with " | "; the padding of
+    # the first line may have been stripped along with the command output
+    target_prefix = f"{target_line} | "
+    
     for line in lines:
         # Check if this is the target line
-        if f" {target_line} |" in line or f"{target_line} |" in line:
+        if line.lstrip(' ').startswith(target_prefix):
             formatted_lines.append(f">>> {line}  <<<< BUG HERE")
         else:
             formatted_lines.append(f"    {line}")
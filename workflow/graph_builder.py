@@ -1,7 +1,7 @@
 # workflow/graph_builder.py
 
 from langgraph.graph import StateGraph, START, END
-from typing import Literal
+from typing import List, Literal, Union
 from .state import AgentState 
 from .nodes import (
     lightweight_patch_generator_node,
@@ -12,23 +12,22 @@ from .nodes import (
 )
 from .input_processor import input_processor_node # Import the new data loading node
 
+# Refinement fans out to these nodes in parallel; both only read the
+# validation result, and patch_gen_refine joins on them
+REFINE_BRANCHES = ["analyze_failure", "gather_context"]
+
 # 1. Define the Router Function (Conditional Edge)
-def router_validate(state: AgentState) -> Literal["success", "refine", "give_up"]:
+def router_validate(state: AgentState) -> Union[Literal["success", "give_up"], List[str]]:
     """
     Decides the next node based on the validation result and retry count.
     
     This implements the conditional branching after the 'validate' node.
+    A failed attempt returns REFINE_BRANCHES, which run concurrently.
     """
     
-    result = state.get('validation_result', {})
-    
-    # Success criterion: poc_crash_detected is False AND functional_tests_passed is True
-    is_success = (
-        not result.get('poc_crash_detected', True) and 
-        result.get('functional_tests_passed', False)
-    )
-
-    if is_success:
+    # Success criterion (poc_crash_detected is False AND functional_tests_passed
+    # is True) is evaluated once by validation_node and stored in state
+    if state['is_success']:
         print("\n*** ROUTER: SUCCESS. Final patch found. ***\n")
         return "success"
         
@@ -37,7 +36,7 @@ def router_validate(state: AgentState) -> Literal["success", "refine", "give_up"
         return "give_up"
         
     print(f"\n*** ROUTER: FAILURE. Starting refinement (Attempt {state['retry_count']} of {state['max_retries']}). ***\n")
-    return "refine"
+    return REFINE_BRANCHES
 
 
 # 2. Build and Compile the Graph
@@ -74,13 +73,15 @@ def build_patch_agent_graph():
         {                      # Mapped Destinations
             "success": END,    # Patch found, terminate successfully
             "give_up": END,    # Max retries hit, terminate as failure
-            "refine": "analyze_failure" # Failed, proceed to analysis/refinement
+            # Failed: analysis and context gathering run side by side
+            "analyze_failure": "analyze_failure",
+            "gather_context": "gather_context"
         }
     )
     
     # --- Refinement Loop ---
-    workflow.add_edge("analyze_failure", "gather_context")
-    workflow.add_edge("gather_context", "patch_gen_refine")
+    # patch_gen_refine waits for both parallel branches before it runs
+    workflow.add_edge(REFINE_BRANCHES, "patch_gen_refine")
     workflow.add_edge("patch_gen_refine", "validate")
     
     # Compile and return the runnable graph
@@ -19,7 +19,9 @@ def input_processor_node(state: AgentState) -> AgentState:
     except (ValueError, TypeError):
         raise ValueError(f"Invalid bug_id '{bug_id}'; expected an integer or a string convertible to int.")
     
-    bug_data = load_bug_data(bug_id_int)
+    # Batch runs prefetch bug_data for all bugs in one query; only hit the DB
+    # when nothing was provided
+    bug_data = state.get('bug_data') or load_bug_data(bug_id_int)
     
     if bug_data is None:
         raise Exception(f"CRITICAL ERROR: Failed to load bug data for ID {bug_id} from remote DB.")
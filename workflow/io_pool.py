@@ -0,0 +1,18 @@
+# workflow/io_pool.py
+"""
+One process-wide thread pool for blocking side work (speculative LLM calls,
+code fetches while building batch prompts), instead of a pool per caller.
+"""
+
+import atexit
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Actual concurrency is capped further down: LLM calls by nodes._llm_slots,
+# SSH work by the connection pool in validator.ssh_client
+IO_THREADS = int(os.environ.get('SPA_IO_THREADS', 32))
+
+IO_POOL = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='spa-io')
+
+# Queued work (e.g. a speculative refinement nobody will read) is dropped at exit
+atexit.register(IO_POOL.shutdown, wait=False, cancel_futures=True)
@@ -1,31 +1,322 @@
 # workflow/nodes.py - CODESTRAL VERSION
 
 from mistralai import Mistral
-from typing import Dict
+import httpx
+from typing import Any, Dict, List, Optional, Tuple
 from .state import AgentState 
+from .io_pool import IO_POOL
 import os 
-import json 
 import re
+import atexit
+import shlex
+import logging
+import hashlib
+import functools
+import threading
+import time
+import random
+from concurrent.futures import Future
 from validator.validator_interface import run_validation
+from validator.path_utils import clean_crash_path
+from validator.arvo_data_loader import get_fix_hint
+from validator.ssh_client import run_remote_command
+from validator.repo_cache import ensure_mirror_cmd, mirror_path
+from config import MISTRAL_API_KEY, MAX_CONCURRENT_LLM_CALLS, GITHUB_TOKEN
 
 # Initialize the Mistral Client with Codestral
 client = None
 api_key = None
+LLM_TIMEOUT_MS = 120_000  # Per request; a hung call would otherwise block its bug forever
 
-try:
-    api_key = os.environ.get("MISTRAL_API_KEY")
-    client = Mistral(api_key=api_key)
-
-except Exception as e:
-    print(f"Warning: Could not initialize Mistral client. Details: {e}")
-    client = None
-    api_key = None
+# The SDK accepts a missing key and only fails on the first request, so without
+# one the client is left as None and every node goes straight to its fallback
+if not MISTRAL_API_KEY:
+    print("Warning: MISTRAL_API_KEY is not set; using fallback patches only.")
+else:
+    try:
+        api_key = MISTRAL_API_KEY
+        client = Mistral(api_key=api_key, timeout_ms=LLM_TIMEOUT_MS)
     
+    except Exception as e:
+        print(f"Warning: Could not initialize Mistral client. Details: {e}")
+        client = None
+        api_key = None
+    
+logger = logging.getLogger(__name__)
+
 MODEL = 'codestral-latest'  # Use specific version instead of latest
 PROMPTS_DIR = 'prompts' 
 
+# Once the API rejects our key (401/403) every later call would fail the same
+# way, so the nodes skip straight to the fallback patch instead of paying a round-trip
+LLM_BLOCKED_RE = re.compile(r'\b40[13]\b|unauthori[sz]ed|forbidden', re.IGNORECASE)
+llm_blocked = False
+
+# Batch runs generate patches for several bugs at once (one thread each); this
+# caps how many Codestral requests are in flight so bursts stay under the rate limit
+_llm_slots = threading.BoundedSemaphore(MAX_CONCURRENT_LLM_CALLS)
+
+# SPECULATIVE_REFINEMENT=1 starts the next refinement call while a retry is
+# still being validated (assuming it fails), hiding the LLM round-trip behind
+# the VM run. The prompt has to guess the failure from the previous one, so the
+# answer is only used if the failure_reason is the same (the ASan log itself
+# differs run to run in pids and addresses). A call already in flight can't be
+# cancelled, so a pass or a different failure costs one wasted call.
+# bug_id -> (patch being validated, assumed failure_reason, future)
+SPECULATIVE_REFINEMENT = os.environ.get('SPECULATIVE_REFINEMENT') == '1'
+_speculative_refinements: Dict[str, Tuple[str, str, Future]] = {}
+
+# (bug_id, sha1 of the patch) -> run_validation result. Refinement (especially
+# the template fallback) often reproduces a patch that was already validated;
+# its outcome can't have changed, so the VM run is skipped
+_validation_cache: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+# (repo_url, fix commit, file path, line, context) -> numbered code. The same
+# snippet is fetched by the batch prompt builder, the first patch and every
+# refinement; the source at a fixed commit never changes
+_code_cache: Dict[Tuple[str, str, str, int, int], str] = {}
+
+
+def mark_llm_blocked_if_rejected(error: Exception) -> None:
+    """Remembers an auth/permission rejection so later nodes don't retry the API."""
+    global llm_blocked
+    if LLM_BLOCKED_RE.search(str(error)):
+        print("[PATCH GEN] API rejected the request; using fallback patches from now on")
+        llm_blocked = True
+
+
+def _warm_llm_connection() -> None:
+    """
+    Opens the client's pooled HTTPS connection (and checks the key) with a
+    token-free models.list() call, so the first patch request skips the TLS setup.
+    """
+    try:
+        client.models.list()
+    except Exception as e:
+        mark_llm_blocked_if_rejected(e)
+
+
+# Rate limiting (429), server errors and timeouts usually clear up on their own,
+# so they are retried with jittered exponential backoff before any fallback
+LLM_MAX_ATTEMPTS = 4
+TRANSIENT_LLM_STATUS = {429, 500, 502, 503, 504}
+TRANSIENT_LLM_ERROR_RE = re.compile(r'\b(?:429|50[0234])\b|rate.?limit|timed? ?out|timeout', re.IGNORECASE)
+
+
+def _is_transient_llm_error(error: Exception) -> bool:
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in TRANSIENT_LLM_STATUS
+    return bool(TRANSIENT_LLM_ERROR_RE.search(f"{type(error).__name__} {error}"))
+
+
+# Codestral output is streamed; if this much text has arrived without any diff
+# header the answer is prose, not a patch, and the stream is dropped early
+# (saving the remaining output tokens and time before the fallback)
+NO_DIFF_ABORT_CHARS = 600
+DIFF_HEADER_MARKERS = ('---', 'diff --git')
+
+
+class NotADiffError(Exception):
+    """The model's streamed answer showed no diff header within NO_DIFF_ABORT_CHARS."""
+
+
+# Real patches are a few hundred tokens, so the first request is capped low;
+# only an answer that actually hits the cap is asked for again with more room
+PATCH_MAX_TOKENS = 600
+PATCH_RETRY_MAX_TOKENS = 1500
+
+
+class ResponseTruncatedError(Exception):
+    """The streamed answer was cut off by max_tokens; .text holds what arrived."""
+    
+    def __init__(self, text: str):
+        super().__init__("response reached max_tokens")
+        self.text = text
+
+
+def _stream_completion(prompt: str, temperature: float, max_tokens: int) -> str:
+    """
+    Streams one Codestral completion and returns its text. Raises
+    ResponseTruncatedError if it ran into max_tokens.
+    """
+    chunks = []
+    received = 0
+    saw_header = False
+    with client.chat.stream(
+        model=MODEL,
+        messages=[
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens
+    ) as event_stream:
+        for event in event_stream:
+            if not event.data.choices:
+                continue
+            if event.data.choices[0].finish_reason == 'length':
+                raise ResponseTruncatedError(''.join(chunks) + (event.data.choices[0].delta.content or ''))
+            chunk = event.data.choices[0].delta.content
+            if not isinstance(chunk, str) or not chunk:
+                continue
+            chunks.append(chunk)
+            received += len(chunk)
+            
+            if not saw_header:
+                text = ''.join(chunks)
+                saw_header = any(marker in text for marker in DIFF_HEADER_MARKERS)
+                if not saw_header and received > NO_DIFF_ABORT_CHARS:
+                    raise NotADiffError(f"no diff header in the first {received} chars")
+            
+            # Once the diff is followed by explanation text, the rest would be
+            # cut by clean_codestral_response anyway; leaving the block closes
+            # the stream and stops the generation
+            if saw_header and '\n' in chunk:
+                text = CODE_FENCE_RE.sub('', ''.join(chunks))
+                complete_lines = text[:text.rfind('\n')].splitlines()
+                if _patch_span(complete_lines)[1] < len(complete_lines):
+                    break
+    
+    return ''.join(chunks)
+
+
+def _complete_choices(prompt: str, temperature: float, n: int) -> List[str]:
+    """One (non-streamed) Codestral request sampling n answers; returns their texts."""
+    response = client.chat.complete(
+        model=MODEL,
+        messages=[
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=temperature,
+        max_tokens=PATCH_RETRY_MAX_TOKENS,
+        n=n
+    )
+    return [
+        choice.message.content for choice in response.choices
+        if isinstance(choice.message.content, str) and choice.message.content
+    ]
+
+
+def _call_llm(request, *args):
+    """
+    Runs request(*args) throttled by _llm_slots across threads. Transient errors
+    and empty results are retried up to LLM_MAX_ATTEMPTS times; an answer that
+    isn't a diff returns None right away.
+    """
+    result = None
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        if attempt:
+            # Backoff happens outside the slot, so other bugs' calls can proceed
+            time.sleep(random.uniform(0, 2 ** attempt))
+        try:
+            with _llm_slots:
+                result = request(*args)
+        except NotADiffError as e:
+            print(f"[PATCH GEN] Dropped response early: {e}")
+            return None
+        except Exception as e:
+            if attempt == LLM_MAX_ATTEMPTS - 1 or not _is_transient_llm_error(e):
+                raise
+            print(f"[PATCH GEN] Transient API error (attempt {attempt + 1}/{LLM_MAX_ATTEMPTS}): {e}")
+            continue
+        
+        if result:
+            return result
+        print(f"[PATCH GEN] Empty response (attempt {attempt + 1}/{LLM_MAX_ATTEMPTS})")
+    
+    return result
+
+
+# Identical prompts (a retried bug, two graphs on the same bug) share one call:
+# a caller whose prompt is already in flight waits for that call's answer
+_inflight_prompts: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+# SPA_LLM_CACHE=1 also keeps answers on disk, so re-running a bug reuses them
+# (for LLM_CACHE_MAX_AGE seconds, after which the prompt is sent again)
+LLM_CACHE = os.environ.get('SPA_LLM_CACHE') == '1'
+LLM_CACHE_DIR = os.path.expanduser("~/.cache/smart-patch-agent/llm")
+LLM_CACHE_MAX_AGE = 7 * 24 * 3600
+
+
+def _llm_cache_get(key: str) -> Optional[str]:
+    path = os.path.join(LLM_CACHE_DIR, f"{key}.txt")
+    try:
+        if time.time() - os.path.getmtime(path) > LLM_CACHE_MAX_AGE:
+            return None
+        with open(path, 'r') as f:
+            return f.read() or None
+    except OSError:
+        return None
+
+
+def _llm_cache_put(key: str, text: str) -> None:
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        with open(os.path.join(LLM_CACHE_DIR, f"{key}.txt"), 'w') as f:
+            f.write(text)
+    except OSError as e:
+        print(f"[PATCH GEN] Warning: Could not write LLM cache: {e}")
+
+
+def chat_complete(prompt: str, temperature: float) -> Optional[str]:
+    """
+    Single-turn streamed Codestral call (see _call_llm); returns the response
+    text. Concurrent calls with the same prompt are coalesced into one.
+    """
+    key = hashlib.sha1(f"{MODEL}\0{temperature}\0{prompt}".encode()).hexdigest()
+    with _inflight_lock:
+        pending = _inflight_prompts.get(key)
+        if pending is None:
+            future = _inflight_prompts[key] = Future()
+    if pending is not None:
+        print("[PATCH GEN] Identical prompt already in flight; waiting for its answer")
+        return pending.result()
+    
+    try:
+        text = _llm_cache_get(key) if LLM_CACHE else None
+        if text is None:
+            text = _chat_complete_uncached(prompt, temperature)
+            if LLM_CACHE and text:
+                _llm_cache_put(key, text)
+        else:
+            print("[PATCH GEN] Reusing cached answer for this prompt")
+        future.set_result(text)
+        return text
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight_prompts[key]
+
+
+def _chat_complete_uncached(prompt: str, temperature: float) -> Optional[str]:
+    try:
+        return _call_llm(_stream_completion, prompt, temperature, PATCH_MAX_TOKENS)
+    except ResponseTruncatedError:
+        print(f"[PATCH GEN] Response hit {PATCH_MAX_TOKENS} tokens; asking again with {PATCH_RETRY_MAX_TOKENS}")
+    
+    try:
+        return _call_llm(_stream_completion, prompt, temperature, PATCH_RETRY_MAX_TOKENS)
+    except ResponseTruncatedError as e:
+        return e.text
+
+
+def chat_complete_candidates(prompt: str, temperature: float, n: int) -> List[str]:
+    """Like chat_complete, but samples n answers in one request."""
+    return _call_llm(_complete_choices, prompt, temperature, n) or []
+
+
+@functools.lru_cache(maxsize=32)
 def load_prompt(filename):
-    """Loads a prompt template from the prompts directory."""
+    """Loads a prompt template from the prompts directory (read once per process)."""
     try:
         with open(os.path.join(PROMPTS_DIR, filename), 'r') as f:
             return f.read()
@@ -40,20 +331,10 @@ def analyze_bug_from_data(bug_data: Dict) -> Dict[str, str]:
     bug_category = bug_data.get('bug_category', 'UNKNOWN')
     language = bug_data.get('language', 'C++')
     
-    from validator.arvo_data_loader import get_fix_hint
     fix_hint = get_fix_hint(bug_category)
     
     # Clean up file path properly
-    if '/../' in file_path:
-        parts = file_path.split('/../')
-        file_path = parts[-1]
-    
-    if file_path.startswith('/src/'):
-        file_path = file_path[5:]
-    
-    file_path = file_path.lstrip('/')
-    while file_path.startswith('../'):
-        file_path = file_path[3:]
+    file_path = clean_crash_path(file_path)
     
     return {
         'file_path': file_path,
@@ -64,11 +345,99 @@ def analyze_bug_from_data(bug_data: Dict) -> Dict[str, str]:
     }
 
 
-def fetch_code_from_repo(bug_data: Dict, line_number: int, context_lines: int = 20) -> str:
-    """Fetch actual code from repository."""
-    from validator.ssh_client import run_remote_command, VM_WORKSPACE
+# GitHub-hosted projects are read over HTTPS straight from this process,
+# skipping the SSH hop to the VM; anything else goes through the VM's mirror
+GITHUB_REPO_RE = re.compile(r'^(?:https?://|git@)github\.com[/:]([\w.-]+)/([\w.-]+?)(?:\.git)?/?$')
+GITHUB_TIMEOUT_SECONDS = 10
+# Opened by init_network_clients(); until then GitHub fetches go through the VM
+_github_http: Optional[httpx.Client] = None
+
+
+def init_network_clients() -> None:
+    """
+    Opens the shared GitHub HTTP client and warms the Codestral connection in
+    the background. Called by the entry points (workflow.bootstrap.get_app) so
+    that importing this module never touches the network.
+    """
+    global _github_http
+    if _github_http is None:
+        _github_http = httpx.Client(
+            timeout=GITHUB_TIMEOUT_SECONDS,
+            follow_redirects=True,
+            headers={'Authorization': f'Bearer {GITHUB_TOKEN}'} if GITHUB_TOKEN else {}
+        )
+        atexit.register(_github_http.close)
+        
+        # The client (and its connection pool) is shared by every node and thread
+        if client is not None:
+            threading.Thread(target=_warm_llm_connection, daemon=True).start()
+
+
+@functools.lru_cache(maxsize=256)
+def _github_parent_commit(owner: str, repo: str, commit_hash: str) -> str:
+    """First parent of commit_hash (raw.githubusercontent can't resolve `~1`)."""
+    response = _github_http.get(
+        f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_hash}",
+        headers={'Accept': 'application/vnd.github+json'}
+    )
+    response.raise_for_status()
+    parents = response.json().get('parents') or [{'sha': commit_hash}]
+    return parents[0]['sha']
+
+
+def _source_lines(text: str) -> List[str]:
+    """Splits source text into lines the way sed and nl count them (on newlines only)."""
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def _number_lines(lines: List[str], start_line: int) -> str:
+    """Formats lines like `nl -ba -w 4 -s ' | '`, numbering from start_line."""
+    return '\n'.join(f"{num:>4} | {line}" for num, line in enumerate(lines, start_line))
+
+
+def _fetch_code_from_github(repo_url: str, commit_hash: str, file_path: str,
+                            line_number: int, context_lines: int) -> Optional[str]:
+    """
+    Numbered lines around line_number, in the same format as the VM fetch, or
+    None if repo_url isn't on GitHub or the request fails.
+    """
+    match = GITHUB_REPO_RE.match(repo_url)
+    if not match or _github_http is None:
+        return None
+    owner, repo = match.groups()
+    
+    try:
+        rev = _github_parent_commit(owner, repo, commit_hash)
+        response = _github_http.get(f"https://raw.githubusercontent.com/{owner}/{repo}/{rev}/{file_path}")
+        response.raise_for_status()
+    except (httpx.HTTPError, ValueError, KeyError) as e:
+        logger.debug("[CODE FETCH] GitHub fetch failed, using the VM: %s", e)
+        return None
+    
+    start_line = max(int(line_number) - int(context_lines), 1)
+    end_line = int(line_number) + int(context_lines)
+    lines = _source_lines(response.text)[start_line - 1:end_line]
+    if not lines:
+        return None
     
-    bug_id = bug_data.get('bug_id', 'unknown')
+    print(f"[CODE FETCH] Got {len(lines)} lines of code from GitHub")
+    return _number_lines(lines, start_line)
+
+
+# Printed after the sliced file on the VM; see fetch_code_from_repo
+CODE_END_MARKER = '__SPA_CODE_END__'
+
+
+def fetch_code_from_repo(bug_data: Dict, line_number: int, context_lines: int = 20,
+                         current_commit: str = '') -> str:
+    """
+    Fetch actual code from repository (the VM's mirror of it). current_commit is
+    the commit the validator last cloned from that mirror; when set, the mirror
+    is used without checking or refreshing it.
+    """
     repo_url = bug_data.get('repo_addr')
     commit_hash = bug_data.get('fix_commit')
     file_path = bug_data.get('extracted_file_path', '')
@@ -76,60 +445,56 @@ def fetch_code_from_repo(bug_data: Dict, line_number: int, context_lines: int =
     if not all([repo_url, commit_hash, file_path]):
         return None
     
-    # Clean file path properly
-    if '/../' in file_path:
-        parts = file_path.split('/../')
-        file_path = parts[-1]
+    # Clean file path properly (the /src/ prefix is kept here)
+    file_path = clean_crash_path(file_path, strip_src_prefix=False)
+    
+    logger.debug("[CODE FETCH] Clean file path: %s", file_path)
     
-    file_path = file_path.lstrip('/')
+    cache_key = (repo_url, commit_hash, file_path, int(line_number), int(context_lines))
+    if cache_key in _code_cache:
+        logger.debug("[CODE FETCH] Reusing previously fetched code")
+        return _code_cache[cache_key]
     
-    while file_path.startswith('../'):
-        file_path = file_path[3:]
+    github_code = _fetch_code_from_github(repo_url, commit_hash, file_path, line_number, context_lines)
+    if github_code:
+        _code_cache[cache_key] = github_code
+        return github_code
     
-    workspace = f"{VM_WORKSPACE}/{bug_id}"
+    start_line = max(int(line_number) - int(context_lines), 1)
+    end_line = int(line_number) + int(context_lines)
     
-    print(f"[CODE FETCH] Clean file path: {file_path}")
+    # The file is read straight from the project's mirror on the VM (shared by
+    # every bug of the repo), so no per-bug clone or checkout is needed. After a
+    # validation (current_commit) the mirror is known to hold the commit, since
+    # the validator cloned from it; otherwise it is created or refreshed first.
+    # Only the window is sliced remotely (sed stops reading at its end); the
+    # lines are numbered here.
+    if current_commit:
+        ensure_mirror = ""
+    else:
+        ensure_mirror = f"{{ {ensure_mirror_cmd(repo_url, commit_hash)}; }} >&2 &&"
     
     fetch_cmd = f"""
-        mkdir -p {workspace} &&
-        cd {workspace} &&
-        
-        if [ ! -d "repo_dir" ]; then
-            echo "Cloning repository..."
-            git clone {repo_url} repo_dir 2>&1 | head -10
-        else
-            echo "Repository already exists"
-        fi &&
-        
-        cd repo_dir &&
+        {ensure_mirror}
+        export GIT_DIR={shlex.quote(mirror_path(repo_url))} &&
         
-        echo "Checking out commit {commit_hash}~1..." &&
-        git checkout {commit_hash}~1 2>&1 | head -5 || git checkout {commit_hash} 2>&1 | head -5 &&
+        REV=$(git rev-parse -q --verify {shlex.quote(commit_hash + '~1^{commit}')} || git rev-parse -q --verify {shlex.quote(commit_hash + '^{commit}')}) &&
+        FILE={shlex.quote(file_path)} &&
         
-        echo "Checking if file exists: {file_path}" &&
-        if [ ! -f "{file_path}" ]; then
-            echo "ERROR: File not found: {file_path}"
-            echo "Files in directory:"
-            ls -la $(dirname "{file_path}") 2>&1 | head -10
+        if ! git cat-file -e "$REV:$FILE" 2>/dev/null; then
+            echo "ERROR: File not found: $FILE"
             exit 1
         fi &&
         
-        echo "Extracting code..." &&
-        total_lines=$(wc -l < "{file_path}") &&
-        start_line=$(({line_number} - {context_lines})) &&
-        end_line=$(({line_number} + {context_lines})) &&
-        
-        if [ $start_line -lt 1 ]; then start_line=1; fi &&
-        if [ $end_line -gt $total_lines ]; then end_line=$total_lines; fi &&
-        
-        sed -n "${{start_line}},${{end_line}}p" "{file_path}" | nl -v $start_line -w 4 -s " | "
+        echo "Reading $FILE at $REV" &&
+        git show "$REV:$FILE" | sed -n "{start_line},{end_line}p;{end_line}q" &&
+        echo {CODE_END_MARKER}
     """
     
-    print(f"[CODE FETCH] Executing fetch command...")
+    logger.debug("[CODE FETCH] Executing fetch command...")
     exit_code, stdout, stderr = run_remote_command(fetch_cmd)
     
-    print(f"[CODE FETCH] Exit code: {exit_code}")
-    print(f"[CODE FETCH] Output length: {len(stdout)} chars")
+    logger.debug("[CODE FETCH] Exit code: %s, output length: %d chars", exit_code, len(stdout))
     
     if exit_code != 0:
         print(f"[CODE FETCH] Command failed")
@@ -137,20 +502,18 @@ def fetch_code_from_repo(bug_data: Dict, line_number: int, context_lines: int =
         print(f"[CODE FETCH] Stdout: {stdout[:500]}")
         return None
     
-    if not stdout or len(stdout.strip()) < 10:
-        print(f"[CODE FETCH] No code returned")
-        return None
-    
-    # Extract just the code lines (remove echo messages)
-    lines = stdout.splitlines()
-    code_lines = [line for line in lines if '|' in line]
+    # The code sits between the "Reading" line and the end marker (which keep
+    # its leading/trailing whitespace from being stripped with the output)
+    code = stdout.partition('\n')[2].rpartition(CODE_END_MARKER)[0]
+    code_lines = _source_lines(code)
     
     if not code_lines:
-        print(f"[CODE FETCH] No code lines found in output")
+        print(f"[CODE FETCH] No code returned")
         return None
     
-    result = '\n'.join(code_lines)
+    result = _number_lines(code_lines, start_line)
     print(f"[CODE FETCH] Got {len(code_lines)} lines of code")
+    _code_cache[cache_key] = result
     return result
 
 
@@ -172,171 +535,187 @@ def create_patch_prompt(code: str, file_path: str, line_number: str, bug_type: s
     
     fix_description = fix_descriptions.get(bug_type, 'add safety validation')
     
-    # Highlight the target line
-    code_lines = code.splitlines()
-    highlighted_code = []
-    for line in code_lines:
-        if f" {line_number} |" in line or f"{line_number} |" in line:
-            highlighted_code.append(f">>> {line}  // <- BUG IS HERE")
-        else:
-            highlighted_code.append(f"    {line}")
-    
-    formatted_code = '\n'.join(highlighted_code)
+    # Highlight the target line; a prefix match, since "42 | " also occurs in
+    # "142 | " and inside code text
+    target_prefix = f"{line_number} | "
+    formatted_code = '\n'.join(
+        f">>> {line}  // <- BUG IS HERE" if line.lstrip(' ').startswith(target_prefix) else f"    {line}"
+        for line in code.splitlines()
+    )
     
-    prompt = f"""You are an expert C/C++ code repair specialist. Your task is to fix a {bug_type} bug.
-
-FILE: {file_path}
-BUG LINE: {line_number}
-BUG TYPE: {bug_type}
-FIX NEEDED: {fix_description}
+    # Kept short: input tokens dominate the cost and latency of a small patch
+    prompt = f"""You are an expert C/C++ code repair specialist. Fix the {bug_type} bug in {file_path} at line {line_number} (marked "BUG IS HERE"); the fix should {fix_description}.
 
-BUGGY CODE:
 ```{language.lower()}
 {formatted_code}
 ```
 
-INSTRUCTIONS:
-1. Focus on line {line_number} (marked with "BUG IS HERE")
-2. Generate a minimal fix that {fix_description}
-3. Output ONLY a unified diff patch in this exact format:
+Output ONLY a minimal unified diff (no explanations, no markdown fences) with 3 lines of context, applicable with 'patch -p1':
 
 --- a/{file_path}
 +++ b/{file_path}
-@@ -oldline,count +newline,count @@
- context line (unchanged)
- context line (unchanged)
--old buggy line (if modified)
-+fixed line with safety check
-+additional safety check lines
- context line (unchanged)
- context line (unchanged)
-
-REQUIREMENTS:
-- Output ONLY the patch (no explanations, no markdown fences, no ```)
-- Start directly with "--- a/"
-- Include 3-5 lines of context before and after the change
-- The patch must be applicable with the 'patch -p1' command
-
-Generate the patch now:"""
+@@ -oldline,count +newline,count @@"""
     
     return prompt
 
 
+# Markdown fences around the model's diff (```diff, a bare ``` line, or a stray ```)
+CODE_FENCE_RE = re.compile(r'```(?:diff\s*\n|\s*\n)?')
+# Line prefixes that can appear inside a unified diff ('---'/'+++' are covered by '-'/'+')
+PATCH_LINE_PREFIXES = ('@@', '+', '-', ' ', 'diff')
+# Lines that can open a patch
+PATCH_START_PREFIXES = ('---', 'diff --git')
+
+
+def _patch_span(lines: List[str]) -> Tuple[int, int]:
+    """
+    (first, one past last) index of the patch in the (fence-stripped) response
+    lines; first is -1 if there is no patch.
+    """
+    # Find patch start
+    patch_start = -1
+    for i, line in enumerate(lines):
+        if line.startswith(PATCH_START_PREFIXES):
+            patch_start = i
+            break
+    
+    if patch_start == -1:
+        return -1, len(lines)
+    
+    # The patch runs until explanation text
+    for i in range(patch_start + 6, len(lines)):
+        line = lines[i]
+        if line.strip() and not line.startswith(PATCH_LINE_PREFIXES):
+            return patch_start, i
+    
+    return patch_start, len(lines)
+
+
 def clean_codestral_response(response_text: str) -> str:
     """Clean up Codestral's response to extract just the patch."""
     if not response_text:
         return ""
     
     # Remove markdown fences
-    cleaned = re.sub(r'```diff\s*\n', '', response_text)
-    cleaned = re.sub(r'```\s*\n', '', cleaned)
-    cleaned = re.sub(r'```', '', cleaned)
+    cleaned = CODE_FENCE_RE.sub('', response_text)
     
-    # Find patch start
     lines = cleaned.splitlines()
-    patch_start = -1
-    
-    for i, line in enumerate(lines):
-        if line.startswith('---') or line.startswith('diff --git'):
-            patch_start = i
-            break
+    patch_start, patch_end = _patch_span(lines)
     
     if patch_start == -1:
         return cleaned.strip()
     
-    # Extract from patch start to end (or until explanation text)
-    patch_lines = []
-    for i in range(patch_start, len(lines)):
-        line = lines[i]
-        
-        # Stop if we hit explanatory text
-        if i > patch_start + 5 and line and not any([
-            line.startswith('---'),
-            line.startswith('+++'),
-            line.startswith('@@'),
-            line.startswith('+'),
-            line.startswith('-'),
-            line.startswith(' '),
-            line.startswith('diff'),
-            line.strip() == ''
-        ]):
-            break
-        
-        patch_lines.append(line)
-    
-    return '\n'.join(patch_lines).strip()
+    return '\n'.join(lines[patch_start:patch_end]).strip()
 
 
-def generate_fallback_patch(analysis: Dict, code: str) -> str:
+@functools.lru_cache(maxsize=64)
+def _parse_numbered_code(code: str) -> Dict[int, str]:
     """
-    Generate a simple template patch when LLM fails.
-    Uses the actual code context.
+    Maps line number -> source text for `nl`-numbered code ("  42 | text").
+    Memoized, since refinement retries keep passing the same snippet.
     """
-    file_path = analysis['file_path']
-    line_num = int(analysis['line_number']) if analysis['line_number'].isdigit() else 100
-    bug_type = analysis['bug_type']
-    
-    # Try to find the actual buggy line from code
-    target_line_content = ""
-    if code:
-        for line in code.splitlines():
-            if f" {line_num} |" in line:
-                # Extract just the code part
-                parts = line.split('|', 1)
-                if len(parts) > 1:
-                    target_line_content = parts[1].strip()
-                break
-    
-    # Generate patch based on bug type
-    if bug_type == 'HEAP_BUFFER_OVERFLOW' or bug_type == 'STACK_BUFFER_OVERFLOW':
-        patch = f"""--- a/{file_path}
+    line_index = {}
+    for line in code.splitlines():
+        head, sep, body = line.partition('|')
+        if sep and head.strip().isdigit():
+            line_index.setdefault(int(head), body.strip())
+    return line_index
+
+
+# Template patches by bug type: (str.format template, stand-in for the target
+# line when it isn't in the fetched code)
+_FALLBACK_TEMPLATES = {
+    'HEAP_BUFFER_OVERFLOW': ("""--- a/{file_path}
 +++ b/{file_path}
 @@ -{line_num},4 +{line_num},7 @@
      // Context before
 +    if (index < 0 || index >= size) {{
 +        return;
 +    }}
-     {target_line_content if target_line_content else '// Array access here'}
+     {target}
      // Context after
-"""
-    
-    elif bug_type == 'NULL_POINTER':
-        patch = f"""--- a/{file_path}
+""", '// Array access here'),
+    'NULL_POINTER': ("""--- a/{file_path}
 +++ b/{file_path}
 @@ -{line_num},3 +{line_num},6 @@
      // Context before
 +    if (ptr == nullptr) {{
 +        return;
 +    }}
-     {target_line_content if target_line_content else '// Pointer use here'}
-"""
-    
-    else:
-        patch = f"""--- a/{file_path}
+     {target}
+""", '// Pointer use here'),
+}
+_FALLBACK_TEMPLATES['STACK_BUFFER_OVERFLOW'] = _FALLBACK_TEMPLATES['HEAP_BUFFER_OVERFLOW']
+_GENERIC_FALLBACK_TEMPLATE = ("""--- a/{file_path}
 +++ b/{file_path}
 @@ -{line_num},3 +{line_num},6 @@
      // Context before
 +    if (!validate()) {{
 +        return;
 +    }}
-     {target_line_content if target_line_content else '// Risky operation here'}
-"""
+     {target}
+""", '// Risky operation here')
+
+
+def generate_fallback_patch(analysis: Dict, code: str) -> str:
+    """
+    Generate a simple template patch when LLM fails.
+    Uses the actual code context.
+    """
+    file_path = analysis['file_path']
+    line_num = int(analysis['line_number']) if analysis['line_number'].isdigit() else 100
+    bug_type = analysis['bug_type']
+    
+    # Try to find the actual buggy line from code
+    target_line_content = _parse_numbered_code(code).get(line_num, "") if code else ""
+    
+    template, placeholder = _FALLBACK_TEMPLATES.get(bug_type, _GENERIC_FALLBACK_TEMPLATE)
+    patch = template.format(
+        file_path=file_path, line_num=line_num, target=target_line_content or placeholder
+    )
     
     return patch.strip()
 
 
+# SPA_PATCH_CANDIDATES=k samples k patches in the first Codestral call; each
+# is validated in turn before a refinement (a second LLM call) is needed
+PATCH_CANDIDATES = int(os.environ.get('SPA_PATCH_CANDIDATES', 1))
+
+# Bug types whose first attempt is the template patch, validated before any
+# Codestral call (refinement still uses the LLM if it fails), e.g.
+# SPA_FAST_PATH_BUG_TYPES=NULL_POINTER. Empty by default: the templates are
+# generic and only pay off for bug types where they are known to apply
+FAST_PATH_BUG_TYPES = frozenset(filter(None, os.environ.get('SPA_FAST_PATH_BUG_TYPES', '').split(',')))
+
+# The first attempt sees a narrow window around the bug line (fewer prompt
+# tokens); refinements, which follow a failed attempt, get a wider one.
+# Lines on each side of the bug line, tunable via SPA_CONTEXT_LINES /
+# SPA_REFINEMENT_CONTEXT_LINES
+INITIAL_CONTEXT_LINES = int(os.environ.get('SPA_CONTEXT_LINES', 8))
+REFINEMENT_CONTEXT_LINES = int(os.environ.get('SPA_REFINEMENT_CONTEXT_LINES', 20))
+
+
 def lightweight_patch_generator_node(state: AgentState) -> AgentState:
     print("--- NODE 1: Lightweight Patch Generator (Codestral) ---")
     
+    # BATCH_MODE runs generate the initial patches up front in one batch job
+    if state.get('current_patch'):
+        print(f"[PATCH GEN] Using pregenerated patch ({len(state['current_patch'])} chars)")
+        return state
+    
     bug_data = state.get('bug_data', {})
     analysis = analyze_bug_from_data(bug_data)
+    state['analysis'] = analysis
     
     print(f"[PATCH GEN] Target: {analysis['file_path']}:{analysis['line_number']}")
     print(f"[PATCH GEN] Bug type: {analysis['bug_type']}")
     
     # Step 1: Fetch real code
     line_num = int(analysis['line_number']) if analysis['line_number'].isdigit() else 0
-    actual_code = fetch_code_from_repo(bug_data, line_num, context_lines=15)
+    actual_code = fetch_code_from_repo(bug_data, line_num, context_lines=INITIAL_CONTEXT_LINES)
+    # The buggy revision never changes, so refinement retries reuse this snippet
+    state['actual_code'] = actual_code or ''
+    state['context_lines'] = INITIAL_CONTEXT_LINES if actual_code else 0
     
     if not actual_code:
         print("[PATCH GEN] Could not fetch code, using fallback")
@@ -346,8 +725,13 @@ def lightweight_patch_generator_node(state: AgentState) -> AgentState:
         return state
     
     # Step 2: Try Codestral
-    if client is None:
-        print("[PATCH GEN] No Mistral client, using fallback")
+    if analysis['bug_type'] in FAST_PATH_BUG_TYPES:
+        print(f"[PATCH GEN] {analysis['bug_type']} is on the template fast path, skipping Codestral")
+        state['current_patch'] = generate_fallback_patch(analysis, actual_code)
+        return state
+    
+    if client is None or llm_blocked:
+        print("[PATCH GEN] No usable Mistral client, using fallback")
         fallback_patch = generate_fallback_patch(analysis, actual_code)
         state['current_patch'] = fallback_patch
         return state
@@ -361,54 +745,46 @@ def lightweight_patch_generator_node(state: AgentState) -> AgentState:
         language=analysis['language']
     )
     
-    print(f"[PATCH GEN] Created prompt ({len(prompt)} chars)")
+    logger.debug("[PATCH GEN] Created prompt (%d chars, ~%d tokens)", len(prompt), len(prompt) // 4)
     
     try:
         print("[PATCH GEN] Calling Codestral...")
-        print(f"[PATCH GEN] Using model: {MODEL}")
-        print(f"[PATCH GEN] API key present: {bool(api_key)}")
-        if api_key:
-            print(f"[PATCH GEN] API key starts with: {api_key[:10]}...")
+        logger.debug("[PATCH GEN] Using model: %s (API key present: %s)", MODEL, bool(api_key))
         
         # Call Codestral using Mistral SDK
-        response = client.chat.complete(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.3,
-            max_tokens=2000
-        )
-        
-        print("[PATCH GEN] API call successful")
-        
-        if not response or not response.choices:
-            print("[PATCH GEN] Codestral returned empty response, using fallback")
-            fallback_patch = generate_fallback_patch(analysis, actual_code)
-            state['current_patch'] = fallback_patch
-            return state
+        if PATCH_CANDIDATES > 1:
+            raw_patches = chat_complete_candidates(prompt, temperature=0.7, n=PATCH_CANDIDATES)
+        else:
+            raw_patch = chat_complete(prompt, temperature=0.3)
+            raw_patches = [raw_patch] if raw_patch else []
         
-        raw_patch = response.choices[0].message.content
+        logger.debug("[PATCH GEN] API call successful")
         
-        if not raw_patch:
-            print("[PATCH GEN] Codestral returned None, using fallback")
+        if not raw_patches:
+            print("[PATCH GEN] Codestral returned no patch, using fallback")
             fallback_patch = generate_fallback_patch(analysis, actual_code)
             state['current_patch'] = fallback_patch
             return state
         
-        # Clean the response
-        cleaned_patch = clean_codestral_response(raw_patch)
+        # Clean the responses (identical samples are validated once)
+        cleaned_patches = list(dict.fromkeys(map(clean_codestral_response, raw_patches)))
+        cleaned_patch = cleaned_patches[0]
         
         print(f"[PATCH GEN] Codestral generated patch ({len(cleaned_patch)} chars)")
-        print(f"[PATCH GEN] Preview: {cleaned_patch[:200]}...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[PATCH GEN] Preview: %s...", cleaned_patch[:200])
         
         state['current_patch'] = cleaned_patch
+        # Other samples that are actual diffs; validation tries them in turn
+        state['candidate_patches'] = [
+            patch for patch in cleaned_patches[1:] if patch.startswith(PATCH_START_PREFIXES)
+        ]
+        if state['candidate_patches']:
+            print(f"[PATCH GEN] {len(state['candidate_patches'])} more candidate patch(es) queued")
         
     except Exception as e:
         print(f"[PATCH GEN] Error: {e}")
+        mark_llm_blocked_if_rejected(e)
         print("[PATCH GEN] Using fallback patch")
         fallback_patch = generate_fallback_patch(analysis, actual_code)
         state['current_patch'] = fallback_patch
@@ -416,20 +792,66 @@ def lightweight_patch_generator_node(state: AgentState) -> AgentState:
     return state
 
 
+def _validate_patch(bug_id: str, bug_data: Dict, patch: str) -> Dict[str, Any]:
+    """run_validation for one patch, going through _validation_cache."""
+    cache_key = (bug_id, hashlib.sha1(patch.encode()).hexdigest())
+    result = _validation_cache.get(cache_key)
+    if result is not None:
+        print("[VALIDATION] Identical patch already validated; reusing its result")
+        return result
+    
+    result = run_validation(
+        bug_id,
+        bug_data['repo_addr'],
+        patch,
+        bug_data['fix_commit'],
+        bug_data['reproducer_vul'] 
+    )
+    # Setup failures (SSH, clone) carry no checked_out_commit; those may be
+    # transient, so only results of an actual patch/PoC run are kept
+    if result.get('checked_out_commit'):
+        _validation_cache[cache_key] = result
+    return result
+
+
 def validation_node(state: AgentState) -> AgentState:
     print("--- NODE 2: Validation Node (VM Execution) ---")
     
     bug_data = state.get('bug_data')
     if not bug_data:
         raise Exception("Validation Node failed: Required 'bug_data' not found in state.")
+    
+    cache_key = (state['bug_id'], hashlib.sha1(state['current_patch'].encode()).hexdigest())
+    already_validated = cache_key in _validation_cache
+    
+    # On a retry (there is a previous failure to refine from), ask for the next
+    # patch now; refinement_patch_generator_node picks it up if this one fails
+    if (not already_validated and SPECULATIVE_REFINEMENT and state.get('validation_result') and state.get('actual_code')
+            and client is not None and not llm_blocked and state['retry_count'] < state['max_retries']):
+        print("[PATCH GEN] Starting speculative refinement during validation")
+        prompt = create_refinement_prompt(
+            state.get('analysis') or analyze_bug_from_data(bug_data),
+            state['actual_code'],
+            state['current_patch'],
+            state['failure_reason'],
+            extract_relevant_log(state['validation_result'].get('logs', 'Unknown error'), PROMPT_LOG_WINDOW)
+        )
+        _speculative_refinements[state['bug_id']] = (
+            state['current_patch'], state['failure_reason'],
+            IO_POOL.submit(request_refined_patch, prompt)
+        )
 
-    result = run_validation(
-        state['bug_id'],
-        bug_data['repo_addr'],
-        state['current_patch'],
-        bug_data['fix_commit'],
-        bug_data['reproducer_vul'] 
-    )
+    # The first validation also tries the other candidates of the initial
+    # call, stopping at the first that passes
+    patches = [state['current_patch']] + state.get('candidate_patches', [])
+    state['candidate_patches'] = []
+    for index, patch in enumerate(patches):
+        if index:
+            print(f"[VALIDATION] Trying candidate patch {index + 1}/{len(patches)}")
+        result = _validate_patch(state['bug_id'], bug_data, patch)
+        if not result.get('poc_crash_detected', True) and result.get('functional_tests_passed', False):
+            break
+    state['current_patch'] = patch
     
     is_compiled = result.get('compiled', False)
     poc_crash = result.get('poc_crash_detected', True) 
@@ -442,6 +864,12 @@ def validation_node(state: AgentState) -> AgentState:
     else:
         is_successful = True
         
+    # Routing criterion, computed once here instead of on every router call
+    state['is_success'] = not poc_crash and tests_passed
+    
+    # Lets the refinement fetch reuse the validator's clone
+    state['repo_checked_out_at'] = result.get('checked_out_commit', '')
+    
     state['validation_result'] = {
         'compiled': is_compiled,
         'poc_crash_detected': poc_crash,
@@ -451,64 +879,89 @@ def validation_node(state: AgentState) -> AgentState:
     
     if not is_successful:
         state['retry_count'] += 1
+    
+    # No refinement follows a pass or the last retry: drop the speculative call
+    if state['is_success'] or state['retry_count'] > state['max_retries']:
+        speculative = _speculative_refinements.pop(state['bug_id'], None)
+        if speculative:
+            speculative[2].cancel()
 
     print(f"Validation result: {'SUCCESS' if is_successful else 'FAILURE'}.")
     return state
 
 
-def failure_analyzer_node(state: AgentState) -> AgentState:
-    print("--- NODE 3: Failure Analyzer ---")
+# Failure signatures in the validation log, matched case-insensitively without
+# building a lowercased copy of the (possibly large) log. Two patterns rather
+# than one alternation, so a crash still wins over a syntax error wherever
+# each appears in the log
+CRASH_PERSISTS_RE = re.compile(r'still crashing|asan error', re.IGNORECASE)
+SYNTAX_ERROR_RE = re.compile(r'syntax error', re.IGNORECASE)
+
+
+# Start of the sanitizer report (or other fatal diagnostic) in a validation log
+LOG_ANCHOR_RE = re.compile(r'AddressSanitizer|ERROR:|Assertion|SEGV')
+ANALYSIS_LOG_WINDOW = 2000  # Chars of log the failure heuristics look at
+PROMPT_LOG_WINDOW = 500  # Chars of log quoted in refinement prompts
+
+
+def extract_relevant_log(log: str, window: int = ANALYSIS_LOG_WINDOW) -> str:
+    """
+    The `window` chars of a validation log around its first sanitizer/error
+    line (or its tail, if there is none), so heuristics and prompts stay
+    bounded however verbose the crash output is.
+    """
+    if len(log) <= window:
+        return log
+    anchor = LOG_ANCHOR_RE.search(log)
+    if anchor is None:
+        return log[-window:]
+    start = max(0, anchor.start() - window // 2)
+    return log[start:start + window]
+
+
+def diagnose_failure(validation_result: Dict) -> str:
+    """Classifies a failed validation; depends only on the validation result."""
+    validation_log = extract_relevant_log(validation_result['logs'])
     
-    validation_log = state['validation_result']['logs']
+    # ASan always spells its banner the same way: an exact substring probe
+    # settles the common case before the case-insensitive scan
+    if 'AddressSanitizer' in validation_log or CRASH_PERSISTS_RE.search(validation_log):
+        return "CRASH_PERSISTS"
+    elif not validation_result['compiled'] or SYNTAX_ERROR_RE.search(validation_log):
+        return "COMPILE_ERROR"
+    return "LOGIC_ERROR"
+
+
+# NODES 3 and 4 run in parallel after a failed validation, so each returns
+# only the key it owns (LangGraph rejects two writes to one key in a step)
+def failure_analyzer_node(state: AgentState) -> Dict[str, Any]:
+    print("--- NODE 3: Failure Analyzer ---")
     
-    if "still crashing" in validation_log.lower() or "asan error" in validation_log.lower():
-        reason = "CRASH_PERSISTS"
-    elif "syntax error" in validation_log.lower() or not state['validation_result']['compiled']:
-        reason = "COMPILE_ERROR"
-    else:
-        reason = "LOGIC_ERROR"
-        
-    state['failure_reason'] = reason
+    reason = diagnose_failure(state['validation_result'])
     print(f"Failure diagnosed: {reason}.")
-    return state
+    return {'failure_reason': reason}
 
 
-def lsp_context_gatherer_node(state: AgentState) -> AgentState:
+def lsp_context_gatherer_node(state: AgentState) -> Dict[str, Any]:
     print("--- NODE 4: LSP Context Gatherer ---")
     
-    failure_reason = state['failure_reason']
+    # Derived from the validation result directly rather than from
+    # failure_reason, which the analyzer is writing concurrently
+    failure_reason = diagnose_failure(state['validation_result'])
     
     if "CRASH_PERSISTS" in failure_reason:
         lsp_output = "LSP_CONTEXT: Found bounds issue with array access."
     else:
         lsp_output = "LSP_CONTEXT: Generic context gathered."
         
-    state['lsp_context'] = lsp_output
     print("Gathered static context for refinement.")
-    return state
+    return {'lsp_context': lsp_output}
 
 
-def refinement_patch_generator_node(state: AgentState) -> AgentState:
-    print("--- NODE 5: Refinement Patch Generator (Codestral) ---")
-    
-    bug_data = state.get('bug_data', {})
-    analysis = analyze_bug_from_data(bug_data)
-    
-    # Fetch code again
-    line_num = int(analysis['line_number']) if analysis['line_number'].isdigit() else 0
-    actual_code = fetch_code_from_repo(bug_data, line_num, context_lines=15)
-    
-    if not actual_code or client is None:
-        print("[PATCH GEN] Using fallback for refinement")
-        refined_patch = generate_fallback_patch(analysis, actual_code)
-        state['current_patch'] = refined_patch
-        return state
-    
-    # Create refinement prompt with failure context
-    validation_error = state['validation_result'].get('logs', 'Unknown error')[:500]
-    previous_patch = state['current_patch']
-    
-    refinement_prompt = f"""You are refining a patch that failed validation.
+def create_refinement_prompt(analysis: Dict, actual_code: str, previous_patch: str,
+                             failure_reason: str, validation_error: str) -> str:
+    """Prompt asking Codestral to improve a patch that failed validation."""
+    return f"""You are refining a patch that failed validation.
 
 FILE: {analysis['file_path']}
 LINE: {analysis['line_number']}
@@ -517,7 +970,7 @@ BUG TYPE: {analysis['bug_type']}
 PREVIOUS PATCH (FAILED):
 {previous_patch}
 
-FAILURE REASON: {state['failure_reason']}
+FAILURE REASON: {failure_reason}
 
 VALIDATION ERROR:
 {validation_error}
@@ -537,37 +990,83 @@ Generate an IMPROVED patch that fixes the issue. Output ONLY the unified diff pa
  context
 
 Patch:"""
-    
+
+
+def request_refined_patch(refinement_prompt: str) -> Optional[str]:
+    """Calls Codestral with a refinement prompt; returns the cleaned patch, or None."""
     try:
         print("[PATCH GEN] Calling Codestral for refinement...")
+        logger.debug("[PATCH GEN] Refinement prompt (%d chars, ~%d tokens)",
+                     len(refinement_prompt), len(refinement_prompt) // 4)
         
-        response = client.chat.complete(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": refinement_prompt
-                }
-            ],
-            temperature=0.4,
-            max_tokens=2000
-        )
+        raw_patch = chat_complete(refinement_prompt, temperature=0.4)
         
-        if response and response.choices:
-            raw_patch = response.choices[0].message.content
-            if raw_patch:
-                cleaned_patch = clean_codestral_response(raw_patch)
-                print(f"[PATCH GEN] Codestral refined patch ({len(cleaned_patch)} chars)")
-                state['current_patch'] = cleaned_patch
-                return state
+        if raw_patch:
+            cleaned_patch = clean_codestral_response(raw_patch)
+            print(f"[PATCH GEN] Codestral refined patch ({len(cleaned_patch)} chars)")
+            return cleaned_patch
         
         print("[PATCH GEN] Codestral refinement failed, using fallback")
         
     except Exception as e:
         print(f"[PATCH GEN] Refinement error: {e}")
+        mark_llm_blocked_if_rejected(e)
+    
+    return None
+
+
+def refinement_patch_generator_node(state: AgentState) -> AgentState:
+    print("--- NODE 5: Refinement Patch Generator (Codestral) ---")
+    
+    bug_data = state.get('bug_data', {})
+    analysis = state.get('analysis') or analyze_bug_from_data(bug_data)
+    state['analysis'] = analysis
+    
+    # The first refinement widens the snippet of the first generation (from the
+    # mirror the validator just used, if any); later retries reuse it
+    line_num = int(analysis['line_number']) if analysis['line_number'].isdigit() else 0
+    actual_code = state.get('actual_code')
+    if state.get('context_lines', 0) < REFINEMENT_CONTEXT_LINES:
+        wider_code = fetch_code_from_repo(
+            bug_data, line_num, context_lines=REFINEMENT_CONTEXT_LINES,
+            current_commit=state.get('repo_checked_out_at', '')
+        )
+        if wider_code:
+            actual_code = wider_code
+            state['context_lines'] = REFINEMENT_CONTEXT_LINES
+    state['actual_code'] = actual_code or ''
+    
+    # Every path that doesn't produce an LLM patch ends in the single fallback below
+    refined_patch = None
+    previous_patch = state['current_patch']
+    # A refinement started while this patch was being validated; its prompt
+    # assumed a failure reason, so it only counts if the real one matches
+    speculative = _speculative_refinements.pop(state['bug_id'], None)
+    if speculative and speculative[:2] != (previous_patch, state['failure_reason']):
+        print("[PATCH GEN] Speculative refinement assumed a different failure; discarding it")
+        speculative[2].cancel()
+        speculative = None
+    
+    if actual_code and client is not None and not llm_blocked:
+        if speculative:
+            refined_patch = speculative[2].result()
+            if refined_patch:
+                print(f"[PATCH GEN] Using speculative refinement ({len(refined_patch)} chars)")
+        
+        if not refined_patch:
+            # Create refinement prompt with failure context
+            refinement_prompt = create_refinement_prompt(
+                analysis,
+                actual_code,
+                previous_patch,
+                state['failure_reason'],
+                extract_relevant_log(state.get('validation_result', {}).get('logs', 'Unknown error'), PROMPT_LOG_WINDOW)
+            )
+            refined_patch = request_refined_patch(refinement_prompt)
+    
+    if not refined_patch:
+        refined_patch = generate_fallback_patch(analysis, actual_code)
+        print("Generated fallback refinement patch.")
     
-    # Fallback
-    refined_patch = generate_fallback_patch(analysis, actual_code)
     state['current_patch'] = refined_patch
-    print("Generated fallback refinement patch.")
     return state
\ No newline at end of file
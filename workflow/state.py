@@ -24,9 +24,15 @@ class AgentState(TypedDict):
     # --- Core Loop Fields ---
     all_patches: List[PatchAttempt]
     current_patch: str
+    candidate_patches: List[str]  # Other samples of the first call, tried by the first validation
     validation_result: dict
     failure_reason: str
     lsp_context: str
+    is_success: bool  # Set by validation_node; read by the router
+    repo_checked_out_at: str  # Commit the validator left cloned in repo_dir ('' if none)
+    actual_code: str  # Numbered snippet around the bug line, fetched once per bug
+    context_lines: int  # Lines of context on each side in actual_code (0 if none)
+    analysis: Dict[str, str]  # analyze_bug_from_data(bug_data), computed once per bug
     
     # --- Control Field ---
     retry_count: int
\ No newline at end of file